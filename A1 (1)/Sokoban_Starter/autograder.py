@@ -1,6 +1,7 @@
 # import student's functions
 from solution import *
-from sokoban import sokoban_goal_state, PROBLEMS
+from sokoban import sokoban_goal_state, PROBLEMS, DIRECTIONS, action_names
+import copy
 import os
 
 # Select what to test
@@ -12,6 +13,7 @@ test_iterative_gbfs = True
 test_alternate = True
 test_iterative_astar = True
 test_weighted_astar = True
+test_improve_plan = True
 
 def test_time_astar_fun():
 
@@ -290,6 +292,83 @@ def test_weighted_astar_fun():
     print("Estimated score is {} of 10.".format(summary_score))
     print("*************************************\n")
 
+def replays(final):
+    '''True if every action on the path to final is the move that leads from its parent to it.'''
+    state = final
+    while state.parent:
+        parent = state.parent
+        names = action_names(len(parent.robots))
+        robot, d = next((r, d) for r in range(len(parent.robots)) for d in range(len(DIRECTIONS))
+                        if names[r][d] == state.action)
+        target = DIRECTIONS[d].move(parent.robots[robot])
+        boxes = parent.boxes
+        if target in boxes:
+            boxes = boxes.difference((target,)).union((DIRECTIONS[d].move(target),))
+        if state.robots != parent.robots[:robot] + (target,) + parent.robots[robot + 1:] or \
+                state.boxes != boxes or state.gval != parent.gval + 1:
+            return False
+        state = parent
+    return True
+
+
+def with_detour(final, step, length):
+    '''
+    Returns final with length robot moves out and the same moves back inserted after its step-th state
+    (or the first state after it with room for them).
+    '''
+    path = []
+    state = final
+    while state:
+        path.append(state)
+        state = state.parent
+    path.reverse()
+    for start in path[step:]:
+        detour = [start]
+        while len(detour) <= length:
+            walks = [s for s in detour[-1].successors() if s.boxes == detour[-1].boxes and
+                     all(s.robots != t.robots for t in detour)]
+            if not walks:
+                break
+            detour.append(walks[0])
+        if len(detour) > length:
+            step = path.index(start)
+            break
+    for t in reversed(detour[:-1]):
+        detour.append(next(s for s in detour[-1].successors() if s.robots == t.robots and s.boxes == t.boxes))
+    state = None
+    for s in path[:step] + detour + path[step + 1:]:
+        s = copy.copy(s)
+        s.parent = state
+        s.gval = state.gval + 1 if state else 0
+        state = s
+    return state
+
+
+def test_improve_plan_fun():
+    ##############################################################
+    # TEST PLAN IMPROVEMENT
+    print('Testing plan improvement')
+
+    solved = 0
+    tests = 0
+    for i, step, length in ((2, 3, 3), (3, 0, 1), (3, 3, 1), (4, 2, 2), (7, 10, 3)):
+        final, stats = weighted_astar(PROBLEMS[i], heur_fn=heur_manhattan_distance, weight=1, timebound=5)
+        if not final:
+            continue
+        tests += 1
+        longer = with_detour(final, step, length)
+        improved = improve_plan(longer, timebound=5)
+        if replays(improved) and sokoban_goal_state(improved) and improved.gval <= final.gval:
+            solved += 1
+        else:
+            print("PROBLEM {}: the improved plan of cost {} is wrong or longer than {}".format(i, improved.gval,
+                                                                                               final.gval))
+
+    print("\n*************************************")
+    print("improve_plan removed the detour with a valid plan in {} out of {} tests.".format(solved, tests))
+    print("*************************************\n")
+
+
 def test_all():
     if test_time_astar: test_time_astar_fun()
     if test_time_gbfs: test_time_gbfs_fun()
@@ -299,6 +378,7 @@ def test_all():
     if test_alternate: test_alternate_fun()
     if test_iterative_astar: test_iterative_astar_fun()
     if test_weighted_astar: test_weighted_astar_fun()
+    if test_improve_plan: test_improve_plan_fun()
 
 if __name__=='__main__':
     test_all()
@@ -0,0 +1,130 @@
+'''Batch solving of Sokoban level collections.
+
+   Streams every level of one or more XSB files (see levels.py) through a
+   solver and writes one JSON object per level, as soon as that level is
+   finished, to a JSONL file (or stdout). Levels are read, solved and
+   discarded one at a time, so memory use does not grow with the size of the
+   collection.
+
+   Usage:
+      python batch.py LEVELS.xsb [MORE.xsb ...] [--solver iterative_astar]
+                      [--heuristic alternate] [--weight 10] [--timebound 2]
+                      [--output results.jsonl] [--plans] [--improve 0]
+                      [--deadlock]
+
+   Each record holds the file, level number and title, the level's size, the
+   status ('solved', 'unsolved' or 'error'), the solution cost (and actions,
+   with --plans) and the SearchStats of the run. With --improve, solutions
+   are shortened with solution.improve_plan for that many seconds, and the
+   cost before that is kept as unimproved_cost.
+'''
+import argparse
+import contextlib
+import json
+import math
+import sys
+
+from solution import *
+import levels
+import pattern_db
+
+SOLVERS = ('weighted_astar', 'iterative_astar', 'iterative_gbfs', 'focal_search', 'explicit_estimation_search',
+           'astar', 'best_first')
+HEURISTICS = {
+    'alternate': heur_alternate,
+    'manhattan': heur_manhattan_distance,
+    'zero': heur_zero,
+    'pdb': pattern_db.pdb_heuristic(),
+}
+
+
+def solve(state, solver, heur_fn, weight, timebound):
+    '''Runs one of SOLVERS on state and returns its (goal state or False, SearchStats).'''
+    if solver == 'weighted_astar':
+        return weighted_astar(state, heur_fn, weight, timebound)
+    if solver == 'iterative_astar':
+        return iterative_astar(state, heur_fn, weight, timebound)
+    if solver == 'iterative_gbfs':
+        return iterative_gbfs(state, heur_fn, timebound)
+    if solver == 'focal_search':
+        return focal_search(state, heur_fn, weight, timebound)
+    if solver == 'explicit_estimation_search':
+        return explicit_estimation_search(state, heur_fn, weight=weight, timebound=timebound)
+    se = SearchEngine(solver, 'full')
+    se.init_search(state, sokoban_goal_state, heur_fn)
+    return se.search(timebound)
+
+
+def plan(state):
+    '''Returns the actions leading from the initial state to state.'''
+    state = state.expanded()
+    actions = []
+    while state.parent:
+        actions.append(state.action)
+        state = state.parent
+    actions.reverse()
+    return actions
+
+
+def _finite(value):
+    '''Returns value, or None if it is an infinite or NaN float (which JSON cannot hold).'''
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def run(paths, out, solver='iterative_astar', heuristic='alternate', weight=10, timebound=2, plans=False,
+        improve=0):
+    '''Solves every level in the files at paths, writing one JSON line per level to out.'''
+    heur_fn = HEURISTICS[heuristic]
+    for path in paths:
+        for number, title, rows in levels.iter_boards(path):
+            record = {'file': path, 'level': number, 'title': title, 'solver': solver, 'heuristic': heuristic}
+            try:
+                state = levels.parse_level(rows)
+                record.update(width=state.width, height=state.height, robots=len(state.robots),
+                              boxes=len(state.boxes))
+                # search progress messages would otherwise be mixed into the results.
+                with contextlib.redirect_stdout(sys.stderr):
+                    final, stats = solve(state, solver, heur_fn, weight, timebound)
+                    if final and improve > 0:
+                        record['unimproved_cost'] = final.gval
+                        final = improve_plan(final, timebound=improve)
+                record['status'] = 'solved' if final else 'unsolved'
+                record['cost'] = final.gval if final else None
+                if plans and final:
+                    record['plan'] = plan(final)
+                record['stats'] = dict((key, _finite(value)) for key, value in vars(stats).items()) \
+                    if stats else None
+            except Exception as e:
+                record['status'] = 'error'
+                record['error'] = '{}: {}'.format(type(e).__name__, e)
+            out.write(json.dumps(record, allow_nan=False) + '\n')
+            out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve every level of XSB Sokoban files, writing JSONL results.')
+    parser.add_argument('files', nargs='+', help='XSB level files')
+    parser.add_argument('--solver', choices=SOLVERS, default='iterative_astar')
+    parser.add_argument('--heuristic', choices=sorted(HEURISTICS), default='alternate')
+    parser.add_argument('--weight', type=float, default=10, help='initial weight for the weighted A* solvers, '
+                                                                'suboptimality bound for the focal ones')
+    parser.add_argument('--timebound', type=float, default=2, help='seconds per level')
+    parser.add_argument('--output', help='JSONL file to write (default: stdout)')
+    parser.add_argument('--plans', action='store_true', help='include the solution actions')
+    parser.add_argument('--improve', type=float, default=0, help='seconds spent shortening each solution')
+    parser.add_argument('--deadlock', action='store_true', help='discard deadlocked states (see deadlock.py)')
+    args = parser.parse_args(argv)
+
+    SokobanState.deadlock_detection = args.deadlock
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        run(args.files, out, args.solver, args.heuristic, args.weight, args.timebound, args.plans, args.improve)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+'''Microbenchmark of SokobanState.successors().
+
+   For every entry of PROBLEMS, collects a sample of states reachable from the
+   initial state and reports how many successors() calls per second (and
+   successor states per second) can be made on them.
+
+   Usage:
+      python bench_successors.py [--seconds 0.5] [--sample 200] [--deadlock]
+'''
+import argparse
+from collections import deque
+import time
+
+from sokoban import SokobanState, PROBLEMS
+
+
+def sample_states(initial_state, size):
+    '''Returns up to size distinct states, in breadth first order from initial_state.'''
+    seen = {initial_state.hashable_state()}
+    states = [initial_state]
+    queue = deque(states)
+    while queue and len(states) < size:
+        for succ in queue.popleft().successors():
+            key = succ.hashable_state()
+            if key not in seen:
+                seen.add(key)
+                states.append(succ)
+                queue.append(succ)
+    return states[:size]
+
+
+def bench(states, seconds):
+    '''Returns (successors() calls per second, successors per second) over states.'''
+    calls = 0
+    generated = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < seconds:
+        for state in states:
+            generated += len(state.successors())
+        calls += len(states)
+        elapsed = time.perf_counter() - start
+    return calls / elapsed, generated / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure SokobanState.successors() throughput on PROBLEMS.')
+    parser.add_argument('--seconds', type=float, default=0.5, help='time spent on each problem')
+    parser.add_argument('--sample', type=int, default=200, help='number of states sampled per problem')
+    parser.add_argument('--deadlock', action='store_true', help='turn on deadlock detection')
+    args = parser.parse_args(argv)
+
+    SokobanState.deadlock_detection = args.deadlock
+    print('{:>7} {:>8} {:>12} {:>14}'.format('problem', 'states', 'calls/s', 'successors/s'))
+    total_calls = 0
+    for i, problem in enumerate(PROBLEMS):
+        states = sample_states(problem, args.sample)
+        calls, generated = bench(states, args.seconds)
+        total_calls += calls
+        print('{:>7} {:>8} {:>12.0f} {:>14.0f}'.format(i, len(states), calls, generated))
+    print('mean calls/s: {:.0f}'.format(total_calls / len(PROBLEMS)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+'''Compact closed list for full cycle checking.
+
+   SearchEngine normally records the best g-value found for every state in a
+   dict from state key to g-value. Python dict entries, with their boxed keys
+   and values, cost well over 100 bytes each. A ClosedList stores the same
+   mapping in two flat arrays: 64-bit keys and small unsigned g-values, probed
+   with open addressing (linear probing). With the default 16-bit g-values a
+   state costs 10 bytes per slot, about 14 bytes at the default load factor,
+   so tens of millions of states fit in a few hundred MB.
+
+   State keys are reduced to 64 bits with hash(). hashable_state() values
+   that are already hash() results are unchanged by this. hash() never
+   returns -1, which marks empty slots.
+
+   The table doubles when it gets too full, up to max_bytes, and its
+   g-values are widened to a bigger array type when one does not fit. When
+   the table can neither grow nor widen within max_bytes, the overflow
+   policy decides what happens:
+      'stop'  further insertions are refused and full is set; SearchEngine
+              then ends the search as if it had run out of time.
+      'drop'  new states are no longer recorded (known states can still be
+              updated); the search carries on with weaker cycle checking.
+      'raise' ClosedListFull is raised.
+'''
+from array import array
+
+_EMPTY = -1
+_MASK64 = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+_OVERFLOW_POLICIES = ('stop', 'drop', 'raise')
+# g-value array types, narrowest first, that a table is widened through.
+_GVAL_TYPES = ('B', 'H', 'I', 'Q')
+
+
+class ClosedListFull(Exception):
+    '''Raised by a ClosedList with the 'raise' overflow policy when it is full.'''
+    pass
+
+
+class ClosedList:
+    '''A memory-capped open addressing hash table from state keys to g-values.'''
+
+    def __init__(self, max_bytes=None, overflow='stop', gval_type='H', capacity=1 << 12, max_load=0.75):
+        '''
+        @param max_bytes: The most memory the two arrays may use, or None for no cap.
+        @param overflow: What to do when the table is full at its cap: 'stop', 'drop' or 'raise'.
+        @param gval_type: array typecode of the g-values ('B', 'H', 'I' or 'L').
+        @param capacity: The initial number of slots (rounded up to a power of two).
+        @param max_load: The load factor at which the table grows (or, at its cap, overflows).
+        '''
+        if overflow not in _OVERFLOW_POLICIES:
+            raise Exception('Unknown overflow policy {}, must be one of {}'.format(overflow, _OVERFLOW_POLICIES))
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+        self.gval_type = gval_type
+        self.max_load = max_load
+        self.max_gval = self._max_gval(gval_type)
+        self.full = False
+        self.dropped = 0
+        self.count = 0
+        bits = 4
+        while (1 << bits) < capacity:
+            bits = bits + 1
+        while bits > 4 and max_bytes is not None and self._bytes_for(1 << bits) > max_bytes:
+            bits = bits - 1
+        self._allocate(bits)
+
+    def _bytes_for(self, slots, gval_type=None):
+        return slots * (8 + array(gval_type or self.gval_type).itemsize)
+
+    @staticmethod
+    def _max_gval(gval_type):
+        return (1 << (8 * array(gval_type).itemsize)) - 1
+
+    def _allocate(self, bits):
+        self.bits = bits
+        self.shift = 64 - bits
+        self.mask = (1 << bits) - 1
+        self.keys = array('q', [_EMPTY]) * (1 << bits)
+        self.gvals = array(self.gval_type, [0]) * (1 << bits)
+        self.limit = int(self.max_load * (1 << bits))
+
+    def _slot(self, key):
+        '''Returns the slot holding key, or the empty slot where it would go.'''
+        keys = self.keys
+        mask = self.mask
+        i = ((key * _GOLDEN) & _MASK64) >> self.shift
+        while True:
+            k = keys[i]
+            if k == key or k == _EMPTY:
+                return i
+            i = (i + 1) & mask
+
+    def get(self, key, default=None):
+        '''Returns the g-value recorded for key, or default.'''
+        key = hash(key)
+        i = self._slot(key)
+        if self.keys[i] == _EMPTY:
+            return default
+        return self.gvals[i]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        gval = self.get(key)
+        if gval is None:
+            raise KeyError(key)
+        return gval
+
+    def __setitem__(self, key, gval):
+        key = hash(key)
+        if gval > self.max_gval and not self._widen(gval):
+            self._overflow('g-value {} does not fit in array type {}'.format(gval, self.gval_type))
+            return
+        i = self._slot(key)
+        if self.keys[i] == _EMPTY:
+            if self.count >= self.limit:
+                if not self._grow():
+                    self._overflow('closed list is full ({} states)'.format(self.count))
+                    return
+                i = self._slot(key)
+            self.keys[i] = key
+            self.count = self.count + 1
+        self.gvals[i] = gval
+
+    def __len__(self):
+        return self.count
+
+    def _overflow(self, message):
+        '''Applies the overflow policy to a state that could not be recorded.'''
+        if self.overflow == 'raise':
+            raise ClosedListFull(message)
+        self.full = self.overflow == 'stop'
+        self.dropped = self.dropped + 1
+
+    def _widen(self, gval):
+        '''
+        Moves the g-values to the narrowest wider array type that holds gval. Returns False if
+        there is none, or if it would exceed max_bytes.
+        '''
+        for gval_type in _GVAL_TYPES:
+            if array(gval_type).itemsize > array(self.gval_type).itemsize and gval <= self._max_gval(gval_type):
+                if self.max_bytes is not None and self._bytes_for(len(self.keys), gval_type) > self.max_bytes:
+                    return False
+                self.gvals = array(gval_type, self.gvals)
+                self.gval_type = gval_type
+                self.max_gval = self._max_gval(gval_type)
+                return True
+        return False
+
+    def _grow(self):
+        '''Doubles the table. Returns False if that would exceed max_bytes.'''
+        if self.max_bytes is not None and self._bytes_for(2 << self.bits) > self.max_bytes:
+            return False
+        keys = self.keys
+        gvals = self.gvals
+        self._allocate(self.bits + 1)
+        for j in range(len(keys)):
+            key = keys[j]
+            if key != _EMPTY:
+                i = self._slot(key)
+                self.keys[i] = key
+                self.gvals[i] = gvals[j]
+        return True
+
+    def load_factor(self):
+        '''Returns the fraction of slots in use.'''
+        return self.count / len(self.keys)
+
+    def nbytes(self):
+        '''Returns the memory used by the table's arrays, in bytes.'''
+        return self._bytes_for(len(self.keys))
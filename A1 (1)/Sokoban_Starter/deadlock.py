@@ -0,0 +1,467 @@
+'''Sokoban deadlock detection.
+
+   A state is deadlocked when no sequence of moves can bring every box to a
+   storage point. Deadlocked states can be discarded as soon as they are
+   generated, which keeps them out of the OPEN list and the cycle check
+   dictionary; SokobanState does so when SokobanState.deadlock_detection is
+   set to True (it is off by default). The checks are only sound pruning
+   rules: a state reported as deadlocked can never be solved, but not every
+   unsolvable state is caught.
+
+   All checks are incremental: they are run after a push and look at the box
+   that was just moved. Robots are never treated as blockers since they can
+   always move out of the way.
+
+   A) Per level analysis (LevelInfo)
+      For every storage point, the number of pushes a lone box needs to get
+      there from each square. Squares that reach no storage point are dead
+      squares. The distance tables are kept in the level_cache default cache
+      when one is configured.
+
+   B) Freeze deadlocks
+      A box that can move neither horizontally nor vertically (because of
+      walls, dead squares or other frozen boxes) can never move again, so it
+      must already be on a storage point.
+
+   C) Bipartite matching
+      Every box has to end up on its own storage point. If the boxes cannot be
+      matched to distinct storage points they can each reach, the state is
+      deadlocked.
+
+   D) Closed corrals
+      An area the robots cannot reach, fenced in by boxes and walls, is
+      examined with a small local search over pushes of the fencing boxes only.
+      If that search runs out of pushes before it either stores those boxes or
+      lets a robot into the area, the state is deadlocked.
+
+   E) Learned deadlock patterns (DeadlockPatterns)
+      Whenever a set of boxes is shown to be deadlocked on its own, whatever
+      the robots do, it is shrunk to a minimal deadlocked subset and recorded
+      as a bitmask over the level's squares. Any later state whose boxes
+      contain a recorded pattern is deadlocked, which is a cheap subset test.
+      Besides freeze and matching deadlocks, patterns come from a local search
+      over pushes of the cluster of boxes around the moved box, in which the
+      robots may push from any free square. If PATTERN_DIR is set, patterns
+      are appended to a file per level there and loaded again the next time
+      the level is seen, so later runs start with everything learned so far.
+'''
+from array import array
+from collections import deque
+import os
+
+import level_cache
+from level_cache import level_digest
+
+# Cap on the number of push states examined by the closed corral search.
+CORRAL_SEARCH_LIMIT = 200
+# Cap on the number of push states examined by the local box cluster search.
+LOCAL_SEARCH_LIMIT = 100
+# Largest cluster of neighbouring boxes given to the local search.
+LOCAL_SEARCH_BOXES = 4
+# Number of unproven clusters remembered per level before the memo is cleared.
+UNPROVEN_LIMIT = 100000
+# Directory where learned deadlock patterns are saved (None: memory only).
+PATTERN_DIR = None
+
+# Push distance table entry for squares a box cannot be pushed to the storage point from.
+# Reachable squares never hold it: longer distances are stored as UNREACHABLE - 1.
+UNREACHABLE = 0xFFFF
+_DELTAS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+# Number of levels whose LevelInfo is kept in memory (oldest dropped first).
+LEVEL_LIMIT = 16
+
+# LevelInfo objects, keyed by (width, height, obstacles, storage).
+_levels = dict()
+
+
+class LevelInfo:
+    '''Box reachability data for one level (dimensions, obstacles and storage).'''
+
+    def __init__(self, width, height, obstacles, storage):
+        self.width = width
+        self.height = height
+        self.obstacles = obstacles
+        self.storage = storage
+        self.goals = sorted(storage)
+        cache = level_cache.default_cache()
+        if cache is None:
+            self.distances = self._push_distances()
+        else:
+            self.distances = cache.get(level_digest(width, height, obstacles, storage), 'pushdist16',
+                                       lambda: self._push_distances().tobytes()).cast('H')
+        self.goal_reach = dict()
+        area = width * height
+        for i, goal in enumerate(self.goals):
+            table = self.distances[i * area:(i + 1) * area]
+            self.goal_reach[goal] = frozenset((j % width, j // width) for j in range(area)
+                                              if table[j] != UNREACHABLE)
+        live = set()
+        for reach in self.goal_reach.values():
+            live |= reach
+        self.live = frozenset(live)
+        self.patterns = DeadlockPatterns(self)
+        # masks of box clusters the local search could not prove deadlocked.
+        self.unproven = set()
+
+    def is_wall(self, location):
+        '''Returns True if location is outside the room or is an obstacle.'''
+        x, y = location
+        return x < 0 or x >= self.width or y < 0 or y >= self.height or location in self.obstacles
+
+    def push_distance(self, box, goal):
+        '''Returns the number of pushes a lone box at box needs to reach goal, or UNREACHABLE.'''
+        area = self.width * self.height
+        return self.distances[self.goals.index(goal) * area + box[1] * self.width + box[0]]
+
+    def _push_distances(self):
+        '''
+        Breadth first search over pulls from every storage point. Returns an array('H') with
+        one table of width * height entries per storage point (in sorted order) holding the
+        number of pushes needed to get a lone box from each square onto it.
+        '''
+        area = self.width * self.height
+        distances = array('H', [UNREACHABLE]) * (area * len(self.goals))
+        for i, goal in enumerate(self.goals):
+            base = i * area
+            distances[base + goal[1] * self.width + goal[0]] = 0
+            queue = deque([goal])
+            while queue:
+                x, y = queue.popleft()
+                d = distances[base + y * self.width + x] + 1
+                for dx, dy in _DELTAS:
+                    # pulling the box from (x, y) to (x + dx, y + dy) needs the robot
+                    # to stand at (x + 2dx, y + 2dy) once the box is there.
+                    prev = (x + dx, y + dy)
+                    robot = (x + 2 * dx, y + 2 * dy)
+                    if self.is_wall(prev) or self.is_wall(robot):
+                        continue
+                    j = base + prev[1] * self.width + prev[0]
+                    if distances[j] != UNREACHABLE:
+                        continue
+                    # capped below UNREACHABLE, so that a far square is never taken for a dead one.
+                    distances[j] = min(d, UNREACHABLE - 1)
+                    queue.append(prev)
+        return distances
+
+
+class DeadlockPatterns:
+    '''
+    Minimal deadlocked box subsets of one level, as bitmasks over the level's squares.
+    Square (x, y) is bit y * width + x.
+    '''
+
+    def __init__(self, info):
+        self.width = info.width
+        self.nbytes = (info.width * info.height + 7) // 8
+        self.by_square = dict()  # bit -> masks of the patterns using that square
+        self.count = 0
+        self.path = None
+        if PATTERN_DIR is not None:
+            self.path = os.path.join(PATTERN_DIR, level_digest(info.width, info.height, info.obstacles,
+                                                                info.storage) + '.dlp')
+            self.load(self.path)
+
+    def mask(self, boxes):
+        '''Returns the bitmask of a collection of box locations.'''
+        m = 0
+        for x, y in boxes:
+            m |= 1 << (y * self.width + x)
+        return m
+
+    def matches(self, boxes, moved_box):
+        '''
+        Returns True if boxes contain a recorded pattern that includes moved_box. Only
+        those patterns can have been completed by the last push.
+        '''
+        candidates = self.by_square.get(1 << (moved_box[1] * self.width + moved_box[0]))
+        if not candidates:
+            return False
+        m = self.mask(boxes)
+        for pattern in candidates:
+            if pattern & m == pattern:
+                return True
+        return False
+
+    def add(self, boxes, save=True):
+        '''Records a deadlocked set of box locations.'''
+        self._add_mask(self.mask(boxes), save)
+
+    def _add_mask(self, pattern, save):
+        bits = []
+        rest = pattern
+        while rest:
+            bit = rest & -rest
+            for known in self.by_square.get(bit, ()):
+                if known & pattern == known:
+                    return  # already covered by a smaller pattern
+            bits.append(bit)
+            rest ^= bit
+        for bit in bits:
+            self.by_square.setdefault(bit, []).append(pattern)
+        self.count = self.count + 1
+        if save and self.path is not None:
+            with open(self.path, 'ab') as f:
+                f.write(pattern.to_bytes(self.nbytes, 'little'))
+
+    def load(self, path):
+        '''Adds the patterns saved in path, if it exists.'''
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        for i in range(0, len(data) - self.nbytes + 1, self.nbytes):
+            self._add_mask(int.from_bytes(data[i:i + self.nbytes], 'little'), False)
+
+
+def level_info(width, height, obstacles, storage):
+    '''Returns the (cached) LevelInfo for a level.'''
+    key = (width, height, obstacles, storage)
+    info = _levels.get(key)
+    if info is None:
+        info = LevelInfo(width, height, obstacles, storage)
+        if len(_levels) >= LEVEL_LIMIT:
+            del _levels[next(iter(_levels))]
+        _levels[key] = info
+    return info
+
+
+def is_deadlock(width, height, obstacles, storage, robots, boxes, moved_box):
+    '''
+    Returns True if the position is provably unsolvable.
+    @param robots: The robots' locations after the move.
+    @param boxes: The boxes' locations after the move.
+    @param moved_box: The location the last push moved a box to.
+    '''
+    info = level_info(width, height, obstacles, storage)
+    if moved_box not in info.live:
+        return True
+    if info.patterns.matches(boxes, moved_box):
+        return True
+    frozen = frozen_boxes(info, boxes, moved_box)
+    if frozen - storage:
+        learn(info, frozen)
+        return True
+    violation = matching_violation(info, boxes)
+    if violation:
+        learn(info, violation)
+        return True
+    cluster = box_cluster(boxes, moved_box)
+    if len(cluster) > 1:
+        m = info.patterns.mask(cluster)
+        if m not in info.unproven:
+            if _push_search(info, frozenset(cluster), LOCAL_SEARCH_LIMIT) is False:
+                learn(info, cluster)
+                return True
+            if len(info.unproven) >= UNPROVEN_LIMIT:
+                info.unproven.clear()
+            info.unproven.add(m)
+    return closed_corral(info, robots, boxes, moved_box)
+
+
+def learn(info, boxes):
+    '''
+    Shrinks a deadlocked set of boxes to a minimal subset that is deadlocked on its own
+    and records it. Nothing is recorded if boxes are not deadlocked without the rest.
+    '''
+    subset = set(boxes)
+    if not is_dead_subset(info, subset):
+        return
+    for box in sorted(boxes):
+        subset.discard(box)
+        if not subset or not is_dead_subset(info, subset):
+            subset.add(box)
+    info.patterns.add(subset)
+
+
+def is_dead_subset(info, boxes):
+    '''
+    Returns True if boxes are deadlocked by themselves, with no other boxes in the room
+    and the robots free to stand on any empty square.
+    '''
+    boxes = frozenset(boxes)
+    if boxes - info.live:
+        return True
+    for box in boxes:
+        if frozen_boxes(info, boxes, box) - info.storage:
+            return True
+    if matching_violation(info, boxes):
+        return True
+    return _push_search(info, boxes, LOCAL_SEARCH_LIMIT) is False
+
+
+def box_cluster(boxes, box):
+    '''Returns up to LOCAL_SEARCH_BOXES boxes connected to box through touching (8-neighbour) boxes.'''
+    cluster = [box]
+    for current in cluster:
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                other = (current[0] + dx, current[1] + dy)
+                if other in boxes and other not in cluster:
+                    if len(cluster) == LOCAL_SEARCH_BOXES:
+                        return cluster
+                    cluster.append(other)
+    return cluster
+
+
+def frozen_boxes(info, boxes, box):
+    '''
+    Returns the set of boxes that can never move again, found by starting at box.
+    Empty if box itself can still move.
+    '''
+    involved = set()
+    if not _frozen(info, boxes, box, set(), involved):
+        return frozenset()
+    # box is frozen; re-check every box that the decision depended on.
+    frozen = {box}
+    for other in involved:
+        if other != box and _frozen(info, boxes, other, set(), set()):
+            frozen.add(other)
+    return frozenset(frozen)
+
+
+def _frozen(info, boxes, box, visiting, involved):
+    '''A box is frozen if it is blocked both horizontally and vertically.'''
+    involved.add(box)
+    visiting.add(box)
+    frozen = _blocked(info, boxes, box, (1, 0), visiting, involved) and \
+        _blocked(info, boxes, box, (0, 1), visiting, involved)
+    visiting.discard(box)
+    return frozen
+
+
+def _blocked(info, boxes, box, axis, visiting, involved):
+    '''
+    A box is blocked along an axis if there is a wall on either side, dead squares on
+    both sides, or a frozen box on either side. Boxes in visiting act as walls, which
+    resolves boxes that block each other.
+    '''
+    a = (box[0] - axis[0], box[1] - axis[1])
+    b = (box[0] + axis[0], box[1] + axis[1])
+    if info.is_wall(a) or info.is_wall(b):
+        return True
+    if a not in info.live and b not in info.live:
+        return True
+    for side in (a, b):
+        if side in visiting:
+            return True
+        if side in boxes and _frozen(info, boxes, side, visiting, involved):
+            return True
+    return False
+
+
+def matching_violation(info, boxes):
+    '''
+    Returns a set of boxes that cannot all be given distinct storage points they can
+    reach, or an empty frozenset if every box can be matched.
+    '''
+    candidates = dict()
+    for box in boxes:
+        candidates[box] = [goal for goal, reach in info.goal_reach.items() if box in reach]
+
+    match = dict()  # storage point -> box
+
+    def augment(box, seen):
+        for goal in candidates[box]:
+            if goal in seen:
+                continue
+            seen.add(goal)
+            if goal not in match or augment(match[goal], seen):
+                match[goal] = box
+                return True
+        return False
+
+    for box in boxes:
+        seen = set()
+        if not augment(box, seen):
+            # the boxes competing for the storage points in seen outnumber them.
+            return frozenset([box] + [match[goal] for goal in seen])
+    return frozenset()
+
+
+def _flood(info, seeds, boxes):
+    '''Squares reachable from seeds without crossing walls or boxes.'''
+    reach = set(seeds)
+    queue = deque(seeds)
+    while queue:
+        x, y = queue.popleft()
+        for dx, dy in _DELTAS:
+            nxt = (x + dx, y + dy)
+            if nxt in reach or nxt in boxes or info.is_wall(nxt):
+                continue
+            reach.add(nxt)
+            queue.append(nxt)
+    return reach
+
+
+def closed_corral(info, robots, boxes, moved_box):
+    '''
+    Returns True if moved_box fences in an area that can provably never be opened
+    up, nor can its fence be stored.
+    '''
+    reach = _flood(info, robots, boxes)
+    checked = set()
+    for dx, dy in _DELTAS:
+        start = (moved_box[0] + dx, moved_box[1] + dy)
+        if start in reach or start in checked or start in boxes or info.is_wall(start):
+            continue
+        region = _flood(info, [start], boxes)
+        checked |= region
+        fence = set()
+        for x, y in region:
+            for ex, ey in _DELTAS:
+                if (x + ex, y + ey) in boxes:
+                    fence.add((x + ex, y + ey))
+        if not (fence - info.storage):
+            continue
+        if _push_search(info, frozenset(fence), CORRAL_SEARCH_LIMIT, robots, region) is False:
+            return True
+    return False
+
+
+def _push_search(info, fence, limit, robots=None, region=None):
+    '''
+    Searches over pushes of the boxes in fence alone. Other boxes are removed, which
+    only ever gives the robots more freedom. With robots given, pushes are made from
+    anywhere the robots could possibly be and the search succeeds once it opens up
+    region; with robots None, a push can be made from any empty square. Returns False
+    if the search is exhausted without storing every fence box, True if it succeeds
+    and None if it gives up after limit states.
+    '''
+    start_reach = None
+    if robots is not None:
+        start_reach = frozenset(_flood(info, robots, fence))
+        if start_reach & region:
+            return True
+    start = (fence, start_reach)
+    seen = {start}
+    queue = deque([start])
+    while queue:
+        boxes, reach = queue.popleft()
+        if not (boxes - info.storage):
+            return True
+        for x, y in boxes:
+            for dx, dy in _DELTAS:
+                robot = (x - dx, y - dy)
+                dest = (x + dx, y + dy)
+                if dest in boxes or info.is_wall(dest) or dest not in info.live:
+                    continue
+                if reach is None:
+                    if robot in boxes or info.is_wall(robot):
+                        continue
+                elif robot not in reach:
+                    continue
+                new_boxes = (boxes - {(x, y)}) | {dest}
+                new_reach = None
+                if reach is not None:
+                    new_reach = frozenset(_flood(info, (reach - {dest}) | {(x, y)}, new_boxes))
+                    if new_reach & region:
+                        return True
+                child = (new_boxes, new_reach)
+                if child in seen:
+                    continue
+                if len(seen) >= limit:
+                    return None
+                seen.add(child)
+                queue.append(child)
+    return False
@@ -0,0 +1,318 @@
+'''External memory breadth first search.
+
+   SearchEngine's breadth first search keeps OPEN and the closed list in
+   memory, which limits the levels it can search exhaustively (for example to
+   prove that a level has no solution). ExternalBFS keeps them on disk
+   instead, as files of fixed-length records made by StateSpace.pack(), and
+   only holds a bounded buffer of records in memory:
+
+   A) Every layer (the states at one depth) is a sorted file without
+      duplicates. To build layer d + 1, layer d is read back one record at a
+      time and expanded; successors are collected in a buffer of at most
+      buffer_states records, which is sorted and written out as a run each
+      time it fills.
+   B) The runs are merged (heapq.merge) into one sorted stream, duplicates
+      are dropped as they come out next to each other, and so is every
+      record that is already in an earlier layer, found by walking the
+      (sorted) earlier layers alongside. What is left is layer d + 1.
+   C) Which earlier layers are checked is set by dedup_layers. Checking the
+      last two layers is enough when every action can be undone, but pushes
+      cannot, so a Sokoban state can come back many layers later. By default
+      every earlier layer is checked, through one sorted file of all the
+      states seen so far that is merged with each new layer; this keeps the
+      search finite and proves unsolvability when a layer comes out empty.
+
+   The goal test is done as each layer is read, so the first goal found is at
+   the least depth. Its plan is rebuilt by walking back through the layer
+   files, looking in each for a state that has the next state as a successor.
+
+   ExternalBFS.search returns (goal state or False, SearchStats) like
+   SearchEngine.search. The size of each layer, the bytes read and written
+   to build it and the I/O throughput are kept in ExternalBFS.layers and
+   printed (with trace on) as the search goes.
+
+   Usage:
+      python external_bfs.py [--problem 3 | --level LEVELS.xsb --number 1]
+                             [--buffer 100000] [--dedup-layers 2] [--dir DIR]
+                             [--timebound 60]
+'''
+import argparse
+import heapq
+import os
+import shutil
+import tempfile
+import time
+
+from search import SearchStats, StateSpace
+
+# Records read or written per file operation.
+_BLOCK_RECORDS = 4096
+
+
+class LayerStats:
+    '''What building one layer took.'''
+
+    def __init__(self, depth, size, runs, bytes_read, bytes_written, seconds):
+        self.depth = depth
+        self.size = size
+        self.runs = runs
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.seconds = seconds
+
+    def throughput(self):
+        '''Returns the bytes read and written per second, in MB/s.'''
+        return (self.bytes_read + self.bytes_written) / max(self.seconds, 1e-9) / 1e6
+
+    def __str__(self):
+        return '{:>5} {:>12} {:>5} {:>10.1f} {:>10.1f} {:>8.2f} {:>8.1f}'.format(
+            self.depth, self.size, self.runs, self.bytes_read / 1e6, self.bytes_written / 1e6, self.seconds,
+            self.throughput())
+
+
+LAYER_HEADER = '{:>5} {:>12} {:>5} {:>10} {:>10} {:>8} {:>8}'.format(
+    'depth', 'states', 'runs', 'read MB', 'write MB', 'seconds', 'MB/s')
+
+
+class ExternalBFS:
+    '''Breadth first search with OPEN and the closed list on disk.'''
+
+    def __init__(self, initial_state, goal_fn, directory=None, buffer_states=100000, dedup_layers=None):
+        '''
+        @param initial_state: the state to start from. Its class must implement pack and unpack.
+        @param goal_fn: the goal function.
+        @param directory: where the layer files are kept. Defaults to a temporary directory that
+                          is removed when the search ends.
+        @param buffer_states: the most successors held in memory before a sorted run is written.
+        @param dedup_layers: how many earlier layers new states are checked against, or None for
+                             all of them (see the module documentation).
+        '''
+        self.initial_state = initial_state
+        self.goal_fn = goal_fn
+        self.directory = directory
+        self.buffer_states = buffer_states
+        self.dedup_layers = dedup_layers
+        self.record_size = len(initial_state.pack())
+        self.layers = []
+        self.trace = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def trace_on(self, level=1):
+        '''Print the size and I/O of every layer as it is built.'''
+        self.trace = level
+
+    def trace_off(self):
+        self.trace = 0
+
+    def search(self, timebound=None):
+        '''
+        Searches until a goal is found, a layer comes out empty (no goal is reachable) or
+        timebound seconds have passed. Returns (goal state or False, SearchStats).
+        '''
+        StateSpace.n = 1
+        StateSpace.dead_ends = 0
+        StateSpace.reordered = 0
+        self.layers = []
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.exhausted = False
+        start = os.times()[0]
+        stop = start + timebound if timebound else None
+
+        temporary = self.directory is None
+        directory = tempfile.mkdtemp(prefix='external_bfs-') if temporary else self.directory
+        os.makedirs(directory, exist_ok=True)
+        try:
+            goal = self._search(directory, stop)
+        finally:
+            if temporary:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        stats = SearchStats(self.expanded, self.generated, self.duplicates, 0, os.times()[0] - start,
+                            StateSpace.dead_ends)
+        return goal, stats
+
+    def _layer_path(self, directory, depth):
+        return os.path.join(directory, 'layer-{}.bin'.format(depth))
+
+    def _search(self, directory, stop):
+        initial = self.initial_state.pack()
+        path = self._layer_path(directory, 0)
+        self._write(path, [initial])
+        seen = None
+        if self.dedup_layers is None:
+            seen = os.path.join(directory, 'seen-0.bin')
+            self._write(seen, [initial])
+        self._record_layer(0, 1, 0, time.perf_counter(), 0, 0)
+
+        depth = 0
+        while True:
+            began = time.perf_counter()
+            read_before = self.bytes_read
+            written_before = self.bytes_written
+
+            # A) expand layer depth into sorted runs.
+            runs = []
+            buffer = []
+            for data in self._read(self._layer_path(directory, depth)):
+                if stop and os.times()[0] > stop:
+                    print("TRACE: Search has exceeeded the time bound provided.")
+                    return False
+                state = self.initial_state.unpack(data, None, depth, None)
+                if self.goal_fn(state):
+                    return self._plan(directory, depth, data)
+                self.expanded = self.expanded + 1
+                for succ in state.successors():
+                    buffer.append(succ.pack())
+                if len(buffer) >= self.buffer_states:
+                    runs.append(self._write_run(directory, len(runs), buffer))
+                    buffer = []
+            if buffer:
+                runs.append(self._write_run(directory, len(runs), buffer))
+
+            # B) merge the runs, dropping duplicates and states of earlier layers.
+            if seen is not None:
+                earlier = [seen]
+            else:
+                earlier = [self._layer_path(directory, d) for d in range(max(0, depth + 1 - self.dedup_layers),
+                                                                         depth + 1)]
+            depth = depth + 1
+            path = self._layer_path(directory, depth)
+            size = self._write(path, self._new_states(runs, earlier))
+            for run in runs:
+                os.remove(run)
+
+            # C) add the new layer to the states seen so far.
+            if seen is not None and size:
+                merged = os.path.join(directory, 'seen-{}.bin'.format(depth))
+                self._write(merged, heapq.merge(self._read(seen), self._read(path)))
+                os.remove(seen)
+                seen = merged
+
+            self._record_layer(depth, size, len(runs), began, read_before, written_before)
+            if size == 0:
+                self.exhausted = True
+                return False
+
+    def _new_states(self, runs, earlier):
+        '''Yields the distinct records of the sorted runs that are in none of the sorted earlier files.'''
+        old = heapq.merge(*(self._read(path) for path in earlier))
+        old_record = next(old, None)
+        last = None
+        for record in heapq.merge(*(self._read(run) for run in runs)):
+            if record == last:
+                self.duplicates = self.duplicates + 1
+                continue
+            last = record
+            while old_record is not None and old_record < record:
+                old_record = next(old, None)
+            if record == old_record:
+                self.duplicates = self.duplicates + 1
+                continue
+            yield record
+
+    def _write_run(self, directory, number, buffer):
+        '''Sorts buffer and writes it, without duplicates, as a run file. Returns its path.'''
+        self.generated = self.generated + len(buffer)
+        path = os.path.join(directory, 'run-{}.bin'.format(number))
+        records = sorted(set(buffer))
+        self.duplicates = self.duplicates + len(buffer) - len(records)
+        self._write(path, records)
+        return path
+
+    def _write(self, path, records):
+        '''Writes the records to the file at path. Returns how many there were.'''
+        count = 0
+        block = []
+        with open(path, 'wb') as f:
+            for record in records:
+                block.append(record)
+                if len(block) == _BLOCK_RECORDS:
+                    f.write(b''.join(block))
+                    count = count + len(block)
+                    block = []
+            f.write(b''.join(block))
+            count = count + len(block)
+        self.bytes_written = self.bytes_written + count * self.record_size
+        return count
+
+    def _read(self, path):
+        '''Yields the records of the file at path, in order.'''
+        size = self.record_size
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(size * _BLOCK_RECORDS)
+                if not block:
+                    return
+                self.bytes_read = self.bytes_read + len(block)
+                for i in range(0, len(block), size):
+                    yield block[i:i + size]
+
+    def _record_layer(self, depth, size, runs, began, read_before, written_before):
+        layer = LayerStats(depth, size, runs, self.bytes_read - read_before, self.bytes_written - written_before,
+                           time.perf_counter() - began)
+        self.layers.append(layer)
+        if self.trace:
+            if depth == 0:
+                print(LAYER_HEADER)
+            print(layer)
+
+    def _plan(self, directory, depth, goal):
+        '''
+        Returns the goal state encoded by goal (in layer depth) with its parent chain, found by
+        looking in each earlier layer for a state that has the next one as a successor.
+        '''
+        chain = [goal]
+        for d in range(depth - 1, -1, -1):
+            target = chain[-1]
+            for data in self._read(self._layer_path(directory, d)):
+                state = self.initial_state.unpack(data, None, d, None)
+                if any(succ.pack() == target for succ in state.successors()):
+                    chain.append(data)
+                    break
+            else:
+                raise Exception("No predecessor of a layer {} state found in layer {}".format(d + 1, d))
+        chain.reverse()
+
+        state = self.initial_state
+        for data in chain[1:]:
+            state = next(succ for succ in state.successors() if succ.pack() == data)
+        return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Exhaustive breadth first search of a Sokoban level, on disk.')
+    parser.add_argument('--problem', type=int, default=0, help='index into sokoban.PROBLEMS')
+    parser.add_argument('--level', help='XSB level file (instead of --problem)')
+    parser.add_argument('--number', type=int, default=1, help='level number in --level')
+    parser.add_argument('--buffer', type=int, default=100000, help='successors held in memory per sorted run')
+    parser.add_argument('--dedup-layers', type=int, default=None,
+                        help='check new states against this many earlier layers (default: all)')
+    parser.add_argument('--dir', help='directory for the layer files (default: a temporary directory)')
+    parser.add_argument('--timebound', type=float, default=60, help='seconds')
+    args = parser.parse_args(argv)
+
+    from sokoban import PROBLEMS, sokoban_goal_state
+    if args.level:
+        import levels
+        state = next((state for number, _, state in levels.load_named_levels(args.level)
+                      if number == args.number), None)
+        if state is None:
+            parser.error('{} has no level {}'.format(args.level, args.number))
+    else:
+        state = PROBLEMS[args.problem]
+
+    search = ExternalBFS(state, sokoban_goal_state, args.dir, args.buffer, args.dedup_layers)
+    search.trace_on()
+    goal, stats = search.search(args.timebound)
+    if goal:
+        print('Solution of length {} found.'.format(goal.gval))
+    elif search.exhausted:
+        print('No solution: every reachable state was searched.')
+    print(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+'''Random Sokoban levels.
+
+   generate_level makes a level of a given size, with given numbers of boxes
+   and robots and a given density of obstacles, from a seed. The same
+   arguments always give the same level. Every level it makes is solvable:
+
+   A) Obstacles are scattered over the room at random, keeping its free
+      squares connected, and the storage points are picked among the free
+      squares.
+   B) The level starts solved, with a box on every storage point and the
+      robots on random free squares, and is then played backwards: a robot
+      steps to a free square, pulling the box behind it, if any (and if a
+      coin toss says so). Pulls are pushes played backwards, so the moves
+      made, reversed, solve the level from where the robots and boxes end
+      up. The number of moves played grows with the room's area.
+   C) A level is only kept if every box ended up off the storage points and
+      the boxes' Manhattan distances to their nearest storage points add up
+      to at least min_distance. Otherwise the level is made again, so a
+      bigger room does not give easier levels.
+
+   sweep generates levels for every combination of sizes, box counts and
+   robot counts, solves them with a SearchEngine and tabulates how many
+   were solved, the mean number of nodes expanded and the mean time against
+   the size of the instance.
+
+   Usage:
+      python generator.py [--sizes 5x5,7x7] [--boxes 1,2,3] [--robots 1,2]
+                          [--density 0.1] [--levels 5] [--seed 0]
+                          [--strategy astar] [--heuristic manhattan]
+                          [--timebound 5] [--write LEVELS.txt]
+'''
+import argparse
+import random
+
+from search import *
+from sokoban import SokobanState, sokoban_goal_state, DIRECTIONS
+
+# Reverse moves played per square of the room when pulls is not given.
+PULLS_PER_SQUARE = 8
+
+# Total distance of the boxes from storage required, per box, when min_distance is not given.
+DISTANCE_PER_BOX = 2
+
+# Layouts (each played backwards once) tried before giving up.
+ATTEMPTS = 100
+
+
+def generate_level(width, height, boxes, robots, density=0.1, seed=None, pulls=None, pull_chance=0.8,
+                   min_distance=None):
+    '''
+    Returns the initial SokobanState of a random solvable level.
+    @param width, height: the room's dimensions.
+    @param boxes: the number of boxes (and storage points).
+    @param robots: the number of robots.
+    @param density: the fraction of the room's squares that are obstacles.
+    @param seed: the random seed (None for a different level every time).
+    @param pulls: the number of reverse moves played. Defaults to PULLS_PER_SQUARE per square of the room.
+    @param pull_chance: the probability that a robot with a box behind it pulls it.
+    @param min_distance: the least sum over the boxes of the Manhattan distance to the nearest storage point.
+                         Defaults to DISTANCE_PER_BOX per box.
+    '''
+    if boxes + robots > width * height * (1 - density):
+        raise Exception("A {}x{} room with obstacle density {} has no room for {} boxes and {} robots".format(
+            width, height, density, boxes, robots))
+    rng = random.Random(seed)
+    if pulls is None:
+        pulls = PULLS_PER_SQUARE * width * height
+    if min_distance is None:
+        min_distance = DISTANCE_PER_BOX * boxes
+
+    for _ in range(ATTEMPTS):
+        squares = [(x, y) for y in range(height) for x in range(width)]
+        obstacles = set()
+        for square in rng.sample(squares, int(density * len(squares))):
+            obstacles.add(square)
+            if not _connected(set(squares) - obstacles):
+                obstacles.remove(square)
+        free = [square for square in squares if square not in obstacles]
+        chosen = rng.sample(free, boxes + robots)
+        storage = frozenset(chosen[:boxes])
+        box_set = set(storage)
+        robot_list = chosen[boxes:]
+
+        for _ in range(pulls):
+            robot = rng.randrange(robots)
+            direction = DIRECTIONS[rng.randrange(4)]
+            location = robot_list[robot]
+            target = direction.move(location)
+            if not _free(target, width, height, obstacles, box_set, robot_list):
+                continue
+            behind = (2 * location[0] - target[0], 2 * location[1] - target[1])
+            if behind in box_set and rng.random() < pull_chance:
+                box_set.remove(behind)
+                box_set.add(location)
+            robot_list[robot] = target
+
+        # keep the level only if every box was pulled off the storage points, and far enough in total.
+        if box_set.isdisjoint(storage) and _distance(box_set, storage) >= min_distance:
+            return SokobanState("START", 0, None, width, height, tuple(robot_list), frozenset(box_set), storage,
+                                frozenset(obstacles))
+    raise Exception("The boxes could not be moved {} squares off the storage points in {} attempts".format(
+        min_distance, ATTEMPTS))
+
+
+def _distance(boxes, storage):
+    '''Sum over boxes of the Manhattan distance to the nearest storage point.'''
+    return sum(min(abs(box[0] - goal[0]) + abs(box[1] - goal[1]) for goal in storage) for box in boxes)
+
+
+def _free(square, width, height, obstacles, boxes, robots):
+    x, y = square
+    return 0 <= x < width and 0 <= y < height and square not in obstacles and square not in boxes and \
+        square not in robots
+
+
+def _connected(squares):
+    '''True if squares form one connected region.'''
+    if not squares:
+        return True
+    start = next(iter(squares))
+    seen = {start}
+    stack = [start]
+    while stack:
+        x, y = stack.pop()
+        for nxt in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if nxt in squares and nxt not in seen:
+                seen.add(nxt)
+                stack.append(nxt)
+    return len(seen) == len(squares)
+
+
+def generate_levels(count, width, height, boxes, robots, density=0.1, seed=0):
+    '''
+    Yields count levels, each generated from a seed made of seed, the other arguments and its number.
+    A level that generate_level cannot make is yielded as None.
+    '''
+    for i in range(count):
+        try:
+            yield generate_level(width, height, boxes, robots, density,
+                                 seed='{}:{}x{}:{}:{}:{}:{}'.format(seed, width, height, boxes, robots, density, i))
+        except Exception:
+            yield None
+
+
+class SweepRow:
+    '''The results of one combination of a sweep.'''
+
+    def __init__(self, width, height, boxes, robots, levels, solved, expanded, seconds, cost, skipped=0):
+        self.width = width
+        self.height = height
+        self.boxes = boxes
+        self.robots = robots
+        self.levels = levels
+        self.solved = solved
+        self.expanded = expanded
+        self.seconds = seconds
+        self.cost = cost
+        # levels that could not be generated (counted as unsolved).
+        self.skipped = skipped
+
+    def mean(self, total):
+        '''Returns total divided by the number of levels solved.'''
+        return total / self.solved if self.solved else float('nan')
+
+    def __str__(self):
+        return '{:>7} {:>5} {:>6} {:>8} {:>7} {:>12.0f} {:>9.3f} {:>8.1f}'.format(
+            '{}x{}'.format(self.width, self.height), self.boxes, self.robots, '{}/{}'.format(self.solved, self.levels),
+            self.skipped, self.mean(self.expanded), self.mean(self.seconds), self.mean(self.cost))
+
+
+SWEEP_HEADER = '{:>7} {:>5} {:>6} {:>8} {:>7} {:>12} {:>9} {:>8}'.format(
+    'size', 'boxes', 'robots', 'solved', 'skipped', 'expanded', 'seconds', 'cost')
+
+
+def sweep(sizes, box_counts, robot_counts, heur_fn, density=0.1, levels=5, seed=0, strategy='astar', timebound=5,
+          trace=True, out=None):
+    '''
+    Generates and solves levels for every combination of sizes ((width, height) pairs), box_counts and
+    robot_counts. Returns the list of SweepRows; with trace on they are also printed as they finish.
+    The means are over the solved levels. Levels that cannot be generated are counted as unsolved
+    (and as skipped), so one hard combination does not end the sweep. If out is a file, the levels
+    are written to it (in the format of SokobanState.state_string(), which levels.py reads).
+    '''
+    rows = []
+    if trace:
+        print(SWEEP_HEADER)
+    for width, height in sizes:
+        for boxes in box_counts:
+            for robots in robot_counts:
+                solved = expanded = seconds = cost = skipped = 0
+                for number, state in enumerate(generate_levels(levels, width, height, boxes, robots, density, seed)):
+                    if state is None:
+                        skipped = skipped + 1
+                        continue
+                    if out is not None:
+                        out.write('; {}x{} boxes {} robots {} #{}\n'.format(width, height, boxes, robots, number + 1))
+                        out.write(state.state_string() + '\n')
+                    se = SearchEngine(strategy, 'full')
+                    se.report_timeout = False
+                    se.init_search(state, sokoban_goal_state, heur_fn)
+                    goal, stats = se.search(timebound)
+                    if goal:
+                        solved = solved + 1
+                        expanded = expanded + stats.states_expanded
+                        seconds = seconds + stats.total_time
+                        cost = cost + goal.gval
+                row = SweepRow(width, height, boxes, robots, levels, solved, expanded, seconds, cost, skipped)
+                rows.append(row)
+                if trace:
+                    print(row, flush=True)
+    return rows
+
+
+def main(argv=None):
+    from solution import heur_manhattan_distance, heur_alternate, heur_zero
+
+    heuristics = {'manhattan': heur_manhattan_distance, 'alternate': heur_alternate, 'zero': heur_zero}
+    parser = argparse.ArgumentParser(description='Generate random Sokoban levels and tabulate how search scales.')
+    parser.add_argument('--sizes', default='5x5,7x7', help='comma separated WIDTHxHEIGHT room sizes')
+    parser.add_argument('--boxes', default='1,2,3', help='comma separated box counts')
+    parser.add_argument('--robots', default='1,2', help='comma separated robot counts')
+    parser.add_argument('--density', type=float, default=0.1, help='fraction of squares that are obstacles')
+    parser.add_argument('--levels', type=int, default=5, help='levels per combination')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--strategy', choices=['astar', 'best_first', 'breadth_first', 'ucs'], default='astar')
+    parser.add_argument('--heuristic', choices=sorted(heuristics), default='manhattan')
+    parser.add_argument('--timebound', type=float, default=5, help='seconds per level')
+    parser.add_argument('--write', help='also write the generated levels to this file')
+    args = parser.parse_args(argv)
+
+    try:
+        sizes = [tuple(int(n) for n in size.split('x')) for size in args.sizes.split(',')]
+        box_counts = [int(n) for n in args.boxes.split(',')]
+        robot_counts = [int(n) for n in args.robots.split(',')]
+    except ValueError:
+        parser.error('sizes are WIDTHxHEIGHT and counts are integers, separated by commas')
+
+    out = open(args.write, 'w') if args.write else None
+    try:
+        sweep(sizes, box_counts, robot_counts, heuristics[args.heuristic], args.density, args.levels, args.seed,
+              args.strategy, args.timebound, out=out)
+    finally:
+        if out is not None:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''On-disk cache for per-level precomputation.
+
+   Heuristics and pruning rules precompute tables that only depend on a
+   level's layout: its dimensions, obstacles and storage points (not on where
+   the robots and boxes are). A LevelCache keeps such tables in a directory,
+   addressed by a digest of that layout and an artifact name, so the tables
+   are computed once per level and shared by every later search, driver
+   iteration or process that solves the same level.
+
+   Each artifact is a single binary file (a short header followed by the raw
+   bytes) that is memory-mapped when loaded, so a warm start costs a file
+   open rather than a recomputation. The cache has a size cap: when a store
+   takes it over the cap, the least recently used artifacts are deleted.
+   Loading an artifact marks it as used.
+'''
+import hashlib
+import mmap
+import os
+import struct
+
+_HEADER = struct.Struct('<4sQ')
+_MAGIC = b'SLC1'
+
+# Directory of the default cache used by deadlock and pattern_db (None: no disk cache).
+CACHE_DIR = None
+# Size cap of the default cache, in bytes.
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_default = None
+
+
+def level_digest(width, height, obstacles, storage):
+    '''Returns a hex digest identifying a level by its dimensions, obstacles and storage.'''
+    text = repr((width, height, sorted(obstacles), sorted(storage)))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def default_cache():
+    '''Returns the LevelCache in CACHE_DIR, or None if CACHE_DIR is not set.'''
+    global _default
+    if CACHE_DIR is None:
+        return None
+    if _default is None or _default.directory != CACHE_DIR:
+        _default = LevelCache(CACHE_DIR, CACHE_MAX_BYTES)
+    return _default
+
+
+class LevelCache:
+    '''A size-capped directory of memory-mapped per-level artifacts with LRU eviction.'''
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        '''
+        @param directory: Where artifacts are kept. Created if missing.
+        @param max_bytes: Total size of the artifacts above which the least recently used are evicted.
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest, name):
+        '''Returns the file holding artifact name of the level with the given digest.'''
+        return os.path.join(self.directory, '{}.{}.lc'.format(digest, name))
+
+    def load(self, digest, name):
+        '''Returns a read-only memoryview of a stored artifact, or None if it is not cached.'''
+        path = self.path(digest, name)
+        view = self._map(path)
+        if view is None:
+            self.misses = self.misses + 1
+            return None
+        os.utime(path)  # mark as recently used
+        self.hits = self.hits + 1
+        return view
+
+    def store(self, digest, name, data):
+        '''Saves the bytes-like data as an artifact, evicts to stay under the cap and returns it mapped.'''
+        path = self.path(digest, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(data)))
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        self.evict(keep=path)
+        view = self._map(path)
+        if view is None:
+            view = memoryview(bytes(data))
+        return view
+
+    def _map(self, path):
+        '''Memory-maps an artifact file, or returns None if there is no valid one at path.'''
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                return None
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = _HEADER.unpack_from(mapped)
+        if magic != _MAGIC or len(mapped) != _HEADER.size + length:
+            mapped.close()
+            return None
+        return memoryview(mapped)[_HEADER.size:]
+
+    def get(self, digest, name, build):
+        '''Returns a cached artifact, calling build() to compute (and store) it on a miss.'''
+        view = self.load(digest, name)
+        if view is None:
+            view = self.store(digest, name, build())
+        return view
+
+    def evict(self, keep=None):
+        '''Deletes least recently used artifacts until the cache is within max_bytes.'''
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.lc') and entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.path, st.st_size))
+                total += st.st_size
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def size(self):
+        '''Returns the total size in bytes of the cached artifacts.'''
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.lc'))
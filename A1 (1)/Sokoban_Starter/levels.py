@@ -0,0 +1,143 @@
+'''Sokoban level files.
+
+   Reads levels in the standard XSB text format:
+
+      #  wall                 @  robot              $  box
+      .  storage point        +  robot on storage   *  box on storage
+      space, - or _  floor
+
+   extended for several robots: '@' and '+' may appear more than once (robots
+   are numbered in reading order), and the letters written by
+   SokobanState.state_string() are accepted too ('a', 'b', ... for robots 0,
+   1, ..., upper case when on storage), so printed states can be read back.
+   Letter robots come first, then '@' robots.
+
+   A file may hold any number of levels. A board row starts and ends with a
+   wall (after any floor padding), so a text line such as '# Level A' is not
+   taken for one. Any line that is not part of a board (blank lines,
+   '; comment' lines, 'Title: ...' lines and so on) ends the current level.
+   Levels are parsed and yielded one at a time, so files with thousands of
+   levels can be streamed in constant memory.
+
+   Squares outside the level's outer walls become obstacles, and the room is
+   cropped to the squares inside the walls, since SokobanState surrounds its
+   room with walls of its own.
+'''
+from sokoban import SokobanState
+
+_WALL = '#'
+_FLOOR = ' -_'
+_BOARD = set('#@+$*. -_') | set('abcdefghijklmnopqrstuvwxyz') | set('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+
+def is_board_line(line):
+    '''Returns True if line is a row of a level.'''
+    line = line.rstrip('\r\n')
+    row = line.strip(_FLOOR)
+    return row[:1] == _WALL and row[-1:] == _WALL and set(line) <= _BOARD
+
+
+def load_levels(path):
+    '''Yields a SokobanState for every level in the file at path.'''
+    for _, _, state in load_named_levels(path):
+        yield state
+
+
+def load_named_levels(path):
+    '''
+    Yields (number, title, state) for every level in the file at path. Levels are
+    numbered from 1 in file order. The title is the last non-board line before the
+    level (with any leading ';' or 'Title:' removed), or None.
+    '''
+    for number, title, rows in iter_boards(path):
+        yield number, title, parse_level(rows)
+
+
+def iter_boards(path):
+    '''Yields (number, title, rows) for every level in the file at path, without parsing the rows.'''
+    with open(path) as f:
+        number = 0
+        title = None
+        board = []
+        for line in f:
+            if is_board_line(line):
+                board.append(line.rstrip('\r\n'))
+                continue
+            if board:
+                number = number + 1
+                yield number, title, board
+                board = []
+                title = None
+            text = line.strip()
+            if text:
+                title = _title(text)
+        if board:
+            yield number + 1, title, board
+
+
+def _title(text):
+    '''Strips comment and title markers from a non-board line.'''
+    if text.startswith(';'):
+        text = text[1:].strip()
+    if text.lower().startswith('title:'):
+        text = text[6:].strip()
+    return text or None
+
+
+def parse_level(rows):
+    '''
+    Returns the initial SokobanState of a level.
+    @param rows: The board's lines, top to bottom.
+    '''
+    height = len(rows)
+    width = max(len(row) for row in rows)
+    rows = [row.ljust(width) for row in rows]
+
+    # floor squares connected to the edge of the board lie outside the outer walls.
+    outside = set()
+    stack = [(x, y) for y in range(height) for x in range(width)
+             if (x in (0, width - 1) or y in (0, height - 1)) and rows[y][x] in _FLOOR]
+    while stack:
+        x, y = stack.pop()
+        if (x, y) in outside:
+            continue
+        outside.add((x, y))
+        for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if 0 <= nx < width and 0 <= ny < height and rows[ny][nx] in _FLOOR:
+                stack.append((nx, ny))
+
+    inside = [(x, y) for y in range(height) for x in range(width)
+              if rows[y][x] != _WALL and (x, y) not in outside]
+    if not inside:
+        raise Exception('Level has no squares inside its walls')
+    x0 = min(x for x, _ in inside)
+    x1 = max(x for x, _ in inside)
+    y0 = min(y for _, y in inside)
+    y1 = max(y for _, y in inside)
+    inside = set(inside)
+
+    robots = []
+    boxes = set()
+    storage = set()
+    obstacles = set()
+    for y in range(y0, y1 + 1):
+        for x in range(x0, x1 + 1):
+            location = (x - x0, y - y0)
+            char = rows[y][x]
+            if (x, y) not in inside:
+                obstacles.add(location)
+                continue
+            if char in '.+*' or char.isupper():
+                storage.add(location)
+            if char in '$*':
+                boxes.add(location)
+            if char in '@+':
+                robots.append(((1, y, x), location))
+            elif char.isalpha():
+                robots.append(((0, ord(char.lower()) - ord('a'), 0), location))
+
+    robots.sort()
+    return SokobanState("START", 0, None, x1 - x0 + 1, y1 - y0 + 1,
+                        tuple(location for _, location in robots),
+                        frozenset(boxes), frozenset(storage), frozenset(obstacles))
+
@@ -0,0 +1,245 @@
+'''Sokoban macro moves.
+
+   A macro move is a sequence of moves of one robot that SokobanState
+   generates as a single successor when SokobanState.macro_moves is True.
+   Its cost is the number of moves in it and the moves are recorded in the
+   state, so solution costs are unchanged, and print_path (through
+   SokobanState.expanded()) shows every move. Only the intermediate states
+   are skipped: they are never hashed, queued or expanded.
+
+   Both kinds of macro start from a push and replace it. They are pruning
+   rules that are not always safe: a solution that needs a box left halfway
+   along a tunnel, or a goal room filled in another order, can be lost.
+
+   A) Tunnels
+      A box in a one-wide corridor, with walls on both sides of it and of the
+      robot pushing it, can only be pushed along the corridor. Once pushed
+      into such a tunnel it is pushed on until it leaves the tunnel, reaches a
+      storage point or is blocked by another box or robot.
+
+   B) Goal rooms
+      A goal room is an area holding every storage point that the rest of the
+      level can only enter through one square, its entrance. A packing order
+      of the room's storage points is worked out once per level: it is found
+      backwards, by repeatedly taking out of the full room the box that can
+      be pushed in last. When a box is pushed onto the entrance and the room
+      holds exactly the first k boxes of the order (and no other robot), the
+      box is pushed all the way to storage point k + 1 in the fewest moves.
+
+   Like the other per level tables, the analysis is done once per level and
+   kept for the LEVEL_LIMIT most recent levels.
+'''
+from collections import deque
+
+# Moves by direction index, in the order of sokoban.DIRECTIONS (up, right, down, left).
+_DELTAS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+# Largest goal room (in squares) considered; bigger rooms get no packing order.
+GOAL_ROOM_LIMIT = 64
+
+# Number of levels whose analysis is kept in memory (oldest dropped first).
+LEVEL_LIMIT = 16
+
+# LevelMacros objects, keyed by (width, height, obstacles, storage).
+_levels = dict()
+
+
+def _step(square, d):
+    return (square[0] + _DELTAS[d][0], square[1] + _DELTAS[d][1])
+
+
+class LevelMacros:
+    '''The tunnels and the goal room of one level.'''
+
+    def __init__(self, width, height, obstacles, storage):
+        self.squares = set((x, y) for y in range(height) for x in range(width) if (x, y) not in obstacles)
+        self.storage = storage
+        # tunnels[d] holds the squares that a box pushed in direction d onto keeps being pushed from.
+        self.tunnels = tuple(set() for _ in _DELTAS)
+        for square in self.squares:
+            for d in range(4):
+                behind = _step(square, (d + 2) % 4)
+                if square not in storage and self._walled(square, d) and \
+                        behind in self.squares and self._walled(behind, d):
+                    self.tunnels[d].add(square)
+        self.room = None
+        self.entrance = None
+        self.order = None
+        # paths[(k, outside)]: the moves pushing a box from the entrance (robot at outside) to
+        # order[k], or None if there are none.
+        self.paths = dict()
+        self._find_goal_room()
+
+    def _walled(self, square, d):
+        '''True if both squares beside square, across direction d, are walls.'''
+        return _step(square, (d + 1) % 4) not in self.squares and _step(square, (d + 3) % 4) not in self.squares
+
+    def _find_goal_room(self):
+        '''Finds the smallest area holding every storage point that is entered through one square.'''
+        if not self.storage:
+            return
+        for entrance in self.squares:
+            if entrance in self.storage:
+                continue
+            start = next(iter(self.storage))
+            room = set([start])
+            stack = [start]
+            while stack and len(room) <= GOAL_ROOM_LIMIT:
+                square = stack.pop()
+                for d in range(4):
+                    nxt = _step(square, d)
+                    if nxt in self.squares and nxt != entrance and nxt not in room:
+                        room.add(nxt)
+                        stack.append(nxt)
+            if len(room) > GOAL_ROOM_LIMIT or not self.storage <= room or len(room) + 1 >= len(self.squares):
+                continue
+            if self.room is None or len(room) < len(self.room):
+                self.room = frozenset(room)
+                self.entrance = entrance
+        if self.room is not None:
+            self.order = self._packing_order()
+
+    def _packing_order(self):
+        '''
+        Returns the room's storage points in an order they can be filled in, each box pushed in
+        through the entrance, or None if none is found.
+        '''
+        outside = [_step(self.entrance, d) for d in range(4)
+                   if _step(self.entrance, d) in self.squares and _step(self.entrance, d) not in self.room]
+        filled = set(self.storage)
+        order = []
+        while filled:
+            # take out the storage point that can be filled last, preferring those furthest in.
+            for goal in sorted(filled, key=lambda goal: -self._depth(goal)):
+                if any(self._push_path(self.entrance, robot, goal, filled - {goal}) is not None
+                       for robot in outside):
+                    break
+            else:
+                return None
+            filled.remove(goal)
+            order.append(goal)
+        order.reverse()
+        return tuple(order)
+
+    def _depth(self, goal):
+        '''Walking distance from the entrance to goal through the room.'''
+        seen = {self.entrance: 0}
+        queue = deque([self.entrance])
+        while queue:
+            square = queue.popleft()
+            if square == goal:
+                return seen[square]
+            for d in range(4):
+                nxt = _step(square, d)
+                if nxt in self.room and nxt not in seen:
+                    seen[nxt] = seen[square] + 1
+                    queue.append(nxt)
+        return 0
+
+    def _push_path(self, box, robot, goal, blocked):
+        '''
+        Returns the fewest moves (direction indices) of a robot at robot that push a box from box
+        to goal, staying in the room, its entrance and robot's starting square, with the squares
+        in blocked taken. None if there are none.
+        '''
+        allowed = (self.room | {self.entrance, robot}) - blocked
+        start = (box, robot)
+        parents = {start: None}
+        queue = deque([start])
+        while queue:
+            state = queue.popleft()
+            box_at, robot_at = state
+            if box_at == goal:
+                moves = []
+                while parents[state] is not None:
+                    state, d = parents[state]
+                    moves.append(d)
+                moves.reverse()
+                return tuple(moves)
+            for d in range(4):
+                target = _step(robot_at, d)
+                if target not in allowed:
+                    continue
+                if target == box_at:
+                    beyond = _step(target, d)
+                    if beyond not in allowed or beyond not in self.room and beyond != self.entrance:
+                        continue
+                    nxt = (beyond, target)
+                else:
+                    nxt = (box_at, target)
+                if nxt not in parents:
+                    parents[nxt] = (state, d)
+                    queue.append(nxt)
+        return None
+
+    def room_path(self, boxes, robots, robot):
+        '''
+        Returns the moves taking a box just pushed onto the entrance, by the robot at robot, to the
+        next storage point of the packing order, or None if the macro does not apply.
+        '''
+        if self.order is None:
+            return None
+        inside = boxes & self.room
+        k = len(inside)
+        if k >= len(self.order) or inside != set(self.order[:k]):
+            return None
+        if any(other in self.room for other in robots if other != robot):
+            return None
+        key = (k, robot)
+        if key not in self.paths:
+            self.paths[key] = self._push_path(self.entrance, robot, self.order[k], set(self.order[:k]))
+        return self.paths[key]
+
+
+def level_macros(width, height, obstacles, storage):
+    '''Returns the (cached) LevelMacros of a level.'''
+    key = (width, height, obstacles, storage)
+    info = _levels.get(key)
+    if info is None:
+        info = LevelMacros(width, height, obstacles, storage)
+        if len(_levels) >= LEVEL_LIMIT:
+            del _levels[next(iter(_levels))]
+        _levels[key] = info
+    return info
+
+
+def extend_push(width, height, obstacles, storage, robots, robot, d, boxes, box):
+    '''
+    Extends a push into a macro move, if one applies.
+    @param robots: The robots' locations after the push.
+    @param robot: The index of the robot that pushed.
+    @param d: The direction index of the push.
+    @param boxes: The boxes' locations after the push.
+    @param box: Where the push moved the box to.
+    Returns (robots, boxes, box, moves) after the macro, moves being the direction indices of the
+    moves following the push, or None if no macro applies.
+    '''
+    info = level_macros(width, height, obstacles, storage)
+    if box not in info.tunnels[d] and box != info.entrance:
+        return None
+    location = robots[robot]
+    moves = []
+    while box in info.tunnels[d]:
+        nxt = _step(box, d)
+        if nxt not in info.squares or nxt in boxes or nxt in robots:
+            break
+        boxes = boxes.difference((box,)).union((nxt,))
+        location = box
+        box = nxt
+        moves.append(d)
+
+    if box == info.entrance and location not in info.room:
+        path = info.room_path(boxes, robots, location)
+        if path:
+            for step in path:
+                target = _step(location, step)
+                if target == box:
+                    box = _step(box, step)
+                    boxes = boxes.difference((target,)).union((box,))
+                location = target
+            moves.extend(path)
+
+    if not moves:
+        return None
+    robots = robots[:robot] + (location,) + robots[robot + 1:]
+    return robots, boxes, box, moves
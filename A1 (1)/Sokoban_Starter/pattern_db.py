@@ -0,0 +1,168 @@
+'''Pattern database heuristics for Sokoban.
+
+   A pattern database (PDB) stores the exact cost of an abstraction of the
+   problem. Here the abstraction keeps only k boxes of a level and lets the
+   robots stand wherever they like, so the cost of a pattern is the least
+   number of pushes needed to bring those k boxes onto k distinct storage
+   points. Every push is a robot move, so that cost never overestimates the
+   cost of the real problem.
+
+   The table is filled by a retrograde breadth first search over pulls that
+   starts from every placement of k boxes on storage points. A placement of k
+   boxes on the level's N free squares is a k-combination of square indices
+   and is stored at its rank in the combinatorial number system, one byte per
+   entry, so the table has exactly C(N, k) entries. Costs above MAX_COST are
+   stored as MAX_COST, which keeps them admissible.
+
+   Tables are built once per level and k. When a LevelCache is given (or the
+   level_cache default cache is configured), they are stored there and
+   memory-mapped, so later solves of the same level (in this or another
+   process) start without rebuilding.
+
+   pdb_heuristic() returns a heuristic function usable by SearchEngine:
+   either the sum of the PDB costs of a fixed partition of the boxes into
+   groups of k (additive), or the largest PDB cost of any k of the boxes (max).
+'''
+from collections import deque
+from itertools import combinations
+import math
+
+import level_cache
+
+# Table entry for patterns from which the boxes cannot all be stored.
+UNSOLVABLE = 255
+# Largest cost stored for a pattern that can be stored; greater costs are capped to it.
+MAX_COST = UNSOLVABLE - 1
+_DELTAS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+# Number of pattern databases kept in memory (oldest dropped first).
+DATABASE_LIMIT = 16
+
+# PatternDatabase objects, keyed by (width, height, obstacles, storage, k).
+_databases = dict()
+
+
+class PatternDatabase:
+    '''Exact push costs for every placement of k boxes on one level.'''
+
+    def __init__(self, width, height, obstacles, storage, k, cache=None):
+        '''
+        Loads the table from cache or builds it (and stores it in cache).
+        @param k: The number of boxes in a pattern. Must not exceed the number of storage points.
+        @param cache: A level_cache.LevelCache, or None to keep the table in memory only.
+        '''
+        self.width = width
+        self.height = height
+        self.k = k
+        self.squares = [(x, y) for y in range(height) for x in range(width) if (x, y) not in obstacles]
+        self.index = dict((square, i) for i, square in enumerate(self.squares))
+        self.size = math.comb(len(self.squares), k)
+        self.storage = [self.index[goal] for goal in storage]
+        self.table = None
+        if cache is not None:
+            digest = level_cache.level_digest(width, height, obstacles, storage)
+            name = 'pdb-k{}'.format(k)
+            self.table = cache.get(digest, name, self._build)
+            if len(self.table) != self.size:
+                self.table = cache.store(digest, name, self._build())
+        else:
+            self.table = memoryview(self._build())
+
+    def rank(self, indices):
+        '''Returns the rank of a sorted tuple of square indices.'''
+        r = 0
+        for i, c in enumerate(indices):
+            r += math.comb(c, i + 1)
+        return r
+
+    def cost(self, boxes):
+        '''
+        Returns the least number of pushes that stores k boxes at the given locations,
+        or math.inf if they can never all be stored.
+        '''
+        c = self.table[self.rank(sorted(self.index[box] for box in boxes))]
+        if c == UNSOLVABLE:
+            return math.inf
+        return c
+
+    def _build(self):
+        '''Retrograde breadth first search over pulls from every goal placement.'''
+        # neighbours[d][i] is the index of the square next to square i in direction d, or -1.
+        neighbours = []
+        for dx, dy in _DELTAS:
+            neighbours.append([self.index.get((x + dx, y + dy), -1) for x, y in self.squares])
+
+        table = bytearray([UNSOLVABLE]) * self.size
+        queue = deque()
+        for placement in combinations(sorted(self.storage), self.k):
+            table[self.rank(placement)] = 0
+            queue.append(placement)
+
+        while queue:
+            placement = queue.popleft()
+            cost = min(table[self.rank(placement)] + 1, MAX_COST)
+            for i, square in enumerate(placement):
+                others = placement[:i] + placement[i + 1:]
+                for d in range(4):
+                    # the box was pushed in direction d onto square, from prev, by a
+                    # robot standing at robot.
+                    back = neighbours[(d + 2) % 4]
+                    prev = back[square]
+                    if prev < 0 or prev in others:
+                        continue
+                    robot = back[prev]
+                    if robot < 0 or robot in others:
+                        continue
+                    pred = tuple(sorted(others + (prev,)))
+                    r = self.rank(pred)
+                    if table[r] == UNSOLVABLE:
+                        table[r] = cost
+                        queue.append(pred)
+        return table
+
+
+def pattern_database(width, height, obstacles, storage, k, cache=None):
+    '''Returns the (cached) PatternDatabase of a level for patterns of k boxes.'''
+    key = (width, height, obstacles, storage, k)
+    db = _databases.get(key)
+    if db is None:
+        if cache is None:
+            cache = level_cache.default_cache()
+        db = PatternDatabase(width, height, obstacles, storage, k, cache)
+        if len(_databases) >= DATABASE_LIMIT:
+            del _databases[next(iter(_databases))]
+        _databases[key] = db
+    return db
+
+
+def pdb_heuristic(k=2, combine='add', cache=None):
+    '''
+    Returns an admissible Sokoban heuristic function backed by pattern databases.
+    @param k: The number of boxes per pattern (larger is more informed but slower to build).
+    @param combine: 'add' sums the costs of disjoint groups of k boxes, 'max' takes the
+                    largest cost over every group of k boxes.
+    @param cache: The level_cache.LevelCache holding the tables. Defaults to the
+                  level_cache default cache, if any.
+    '''
+    if combine not in ('add', 'max'):
+        raise Exception("combine must be 'add' or 'max'")
+
+    def heur_pdb(state):
+        '''Pattern database heuristic.'''
+        boxes = sorted(state.boxes)
+        size = min(k, len(boxes), len(state.storage))
+        if size == 0:
+            return 0
+        db = pattern_database(state.width, state.height, state.obstacles, state.storage, size, cache)
+        if combine == 'max':
+            return max(db.cost(group) for group in combinations(boxes, size))
+        total = 0
+        for i in range(0, len(boxes), size):
+            group = boxes[i:i + size]
+            if len(group) < size:
+                db = pattern_database(state.width, state.height, state.obstacles, state.storage, len(group),
+                                      cache)
+            total += db.cost(group)
+        return total
+
+    return heur_pdb
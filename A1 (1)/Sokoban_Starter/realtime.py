@@ -0,0 +1,221 @@
+'''Real-time search.
+
+   RealTimeSearch chooses one action at a time, each within a fixed amount of
+   work, rather than planning all the way to the goal first. It implements
+   LRTA* with an A* lookahead (the RTAA* variant of Koenig and Sun):
+
+   A) Each step runs an A* search (a SearchEngine) from the current state,
+      stopped after at most lookahead expansions (and, optionally, step_time
+      seconds). The current state itself is always expanded, however little
+      time there is, so the agent can always move.
+   B) The search is guided by the learned heuristic: the value recorded in
+      the table for a state if there is one, heur_fn otherwise.
+   C) Let n be the best node on OPEN when the search stops (or the goal, if
+      it found one) and f(n) = g(n) + h(n). For every state s the lookahead
+      expanded, the table records h(s) = f(n) - g(s) where that raises it. If
+      heur_fn is admissible, so is the learned heuristic.
+   D) The agent commits to the first action on the path to n.
+
+   A trial repeats steps from the initial state until it reaches a goal.
+   Pushes cannot be undone, so the agent can walk into a position from which
+   no goal can be reached. Once a lookahead has searched everything
+   reachable from such a position, the table records an infinite h for all
+   of it and the trial fails; later trials steer clear of it.
+
+   The table is kept from one trial to the next, so the heuristic grows more
+   accurate and the trials' solutions converge. When a whole trial makes no
+   change to the table, later trials would follow the same path, and train()
+   stops.
+
+   Usage:
+      python realtime.py [--problem 4] [--lookahead 100] [--trials 20] [--heuristic manhattan]
+'''
+import argparse
+import math
+import time
+
+from search import *
+
+
+class TrialStats:
+    '''What one trial of a RealTimeSearch did.'''
+
+    def __init__(self, trial, solved, cost, steps, expansions, updates, max_latency, table_size):
+        self.trial = trial
+        self.solved = solved
+        self.cost = cost
+        self.steps = steps
+        self.expansions = expansions
+        self.updates = updates
+        self.max_latency = max_latency
+        self.table_size = table_size
+
+    def __str__(self):
+        return '{:>5} {:>6} {:>6} {:>6} {:>10} {:>8} {:>10.4f} {:>8}'.format(
+            self.trial, 'yes' if self.solved else 'no', '-' if self.cost is None else self.cost, self.steps,
+            self.expansions, self.updates, self.max_latency, self.table_size)
+
+
+TRIAL_HEADER = '{:>5} {:>6} {:>6} {:>6} {:>10} {:>8} {:>10} {:>8}'.format(
+    'trial', 'solved', 'cost', 'steps', 'expansions', 'updates', 'max step s', 'learned')
+
+
+class RealTimeSearch:
+    '''LRTA* with a bounded A* lookahead and a heuristic table learned across trials.'''
+
+    def __init__(self, goal_fn, heur_fn, lookahead=100, step_time=None):
+        '''
+        @param goal_fn: the goal function.
+        @param heur_fn: the initial heuristic (admissible, for the learned one to stay admissible).
+        @param lookahead: the most nodes expanded per step (at least 1).
+        @param step_time: if not None, the most time, in seconds, searched per step.
+        '''
+        if lookahead < 1:
+            raise Exception("The lookahead must expand at least one node")
+        self.goal_fn = goal_fn
+        self.heur_fn = heur_fn
+        self.lookahead = lookahead
+        self.step_time = step_time
+        # learned heuristic values, by hashable_state().
+        self.table = dict()
+        self.trials = 0
+
+    def heuristic(self, state):
+        '''The learned heuristic.'''
+        h = self.table.get(state.hashable_state())
+        if h is None:
+            h = self.heur_fn(state)
+        return h
+
+    def step(self, state):
+        '''
+        Looks ahead from state and learns from what it saw. Returns the successor of state to move
+        to, or None if no goal can be reached from state.
+        '''
+        # the heuristic values used by this lookahead, to be raised afterwards.
+        seen = dict()
+
+        def lookahead_heuristic(s):
+            key = s.hashable_state()
+            h = seen.get(key)
+            if h is None:
+                h = self.table.get(key)
+                if h is None:
+                    h = self.heur_fn(s)
+                seen[key] = h
+            return h
+
+        se = SearchEngine('astar', 'full')
+        se.report_timeout = False
+        se.init_search(state, self.goal_fn, lookahead_heuristic)
+        goal, _ = se.search(self.step_time, expansion_bound=self.lookahead)
+        self.expansions = self.expansions + se.expansions
+        if not goal and se.expansions == 0:
+            # out of time before state was expanded: expand it anyway, so there is a move to make.
+            goal, _ = se.search(expansion_bound=1)
+            self.expansions = self.expansions + se.expansions
+
+        # the states on OPEN (by the path recorded for them) were reached but not expanded.
+        frontier = set(node.state.hashable_state() for node in se.open.nodes()
+                       if se.cc_dictionary.get(node.state.hashable_state()) == node.gval)
+        if goal:
+            frontier.add(goal.hashable_state())
+            best_state, best_f = goal, goal.gval
+        else:
+            # the best node still on OPEN (skipping ones reached again by cheaper paths).
+            best_state = None
+            while not se.open.empty():
+                node = se.open.extract()
+                if se.cc_dictionary.get(node.state.hashable_state(), node.gval) == node.gval:
+                    best_state, best_f = node.state, node.gval + node.hval
+                    break
+            if best_state is None:
+                # every state reachable from state was searched and none is a goal. Learn
+                # that, so later trials keep away from here.
+                best_f = math.inf
+
+        for key, gval in se.cc_dictionary.items():
+            if key in frontier:
+                continue
+            h = best_f - gval
+            if h > seen[key]:
+                self.table[key] = h
+                self.updates = self.updates + 1
+
+        if best_state is None:
+            return None
+        if best_state is state:
+            # state is a goal itself: there is nowhere better to go.
+            return state
+        while best_state.parent is not state:
+            best_state = best_state.parent
+        return best_state
+
+    def trial(self, initial_state, max_steps=10000):
+        '''
+        Moves from initial_state, one step at a time, until a goal is reached (or max_steps steps
+        have been taken). Returns (goal state or False, TrialStats). The goal's parents are the
+        states the agent went through.
+        '''
+        self.trials = self.trials + 1
+        self.expansions = 0
+        self.updates = 0
+        max_latency = 0
+        state = initial_state
+        steps = 0
+        while not self.goal_fn(state) and steps < max_steps:
+            began = time.perf_counter()
+            state = self.step(state)
+            max_latency = max(max_latency, time.perf_counter() - began)
+            if state is None:
+                break
+            steps = steps + 1
+
+        solved = state is not None and self.goal_fn(state)
+        stats = TrialStats(self.trials, solved, state.gval if solved else None, steps, self.expansions,
+                           self.updates, max_latency, len(self.table))
+        return (state if solved else False), stats
+
+    def train(self, initial_state, trials=20, max_steps=10000, trace=False):
+        '''
+        Runs up to trials trials from initial_state, stopping early once a trial changes nothing in
+        the table. Returns the cheapest goal state found (or False) and the list of TrialStats.
+        '''
+        best = False
+        history = []
+        if trace:
+            print(TRIAL_HEADER)
+        for _ in range(trials):
+            goal, stats = self.trial(initial_state, max_steps)
+            history.append(stats)
+            if trace:
+                print(stats)
+            if goal and (not best or goal.gval < best.gval):
+                best = goal
+            if stats.updates == 0:
+                break
+        return best, history
+
+
+def main(argv=None):
+    from sokoban import PROBLEMS, sokoban_goal_state
+    from solution import heur_manhattan_distance, heur_alternate, heur_zero
+
+    heuristics = {'manhattan': heur_manhattan_distance, 'alternate': heur_alternate, 'zero': heur_zero}
+    parser = argparse.ArgumentParser(description='Real-time search (LRTA* with lookahead) on a Sokoban problem.')
+    parser.add_argument('--problem', type=int, default=4, help='index into sokoban.PROBLEMS')
+    parser.add_argument('--lookahead', type=int, default=100, help='expansions per step')
+    parser.add_argument('--step-time', type=float, default=None, help='seconds per step')
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--max-steps', type=int, default=10000, help='steps per trial')
+    parser.add_argument('--heuristic', choices=sorted(heuristics), default='manhattan')
+    args = parser.parse_args(argv)
+
+    rts = RealTimeSearch(sokoban_goal_state, heuristics[args.heuristic], args.lookahead, args.step_time)
+    best, _ = rts.train(PROBLEMS[args.problem], args.trials, args.max_steps, trace=True)
+    if best:
+        print('Best solution cost: {}'.format(best.gval))
+
+
+if __name__ == '__main__':
+    main()
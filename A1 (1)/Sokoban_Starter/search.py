@@ -31,20 +31,110 @@
       Open is implemented as a stack when doing depth-first search, as
       a priority queue when doing astar search etc.
 
+      With deferred heuristic evaluation (use_deferred_evaluation), the
+      priority queue strategies do not call heur_fn on the successors they
+      generate. A successor is queued with its parent's h, and its own h is
+      computed when it is taken off OPEN; if that makes it worse than the
+      best node left on OPEN it is queued again. In greedy search the first
+      child that improves on its parent is expanded straight away and its
+      siblings are only evaluated if the search comes back to them, which
+      saves most calls of an expensive heuristic. For astar the successor is
+      queued with its parent's h less the cost of the step (its parent's f),
+      a lower bound for a consistent heuristic, so A* stays optimal; but
+      then nearly every successor is evaluated anyway.
+
+      heur_fn can also be a list of admissible heuristics, cheapest first,
+      for example [heur_manhattan_distance, pdb_heuristic()]. The priority
+      queue strategies then evaluate them lazily: a successor is queued
+      with the first heuristic's value, and the others are only evaluated
+      (one at a time, h becoming the largest value so far) when the node
+      reaches the top of OPEN; as soon as h makes it worse than the best
+      node left it is queued again. Nodes that are never taken off OPEN,
+      or that are found to be goals or to have been reached more cheaply,
+      never pay for the expensive heuristics. The other strategies use the
+      largest of the values. SearchStats reports the evaluations skipped.
+
+      The 'focal' and 'ees' strategies are bounded suboptimal: given a
+      weight w (see init_search), the solution they return costs at most
+      w times the optimal cost, provided heur_fn is admissible. Their OPEN
+      is a FocalOpen, which keeps the nodes ordered several ways at once.
+      'focal' (A*epsilon) expands, among the nodes whose f = g + h is within
+      w of the smallest f on OPEN, the one with the smallest distance-to-go
+      estimate dist_fn. 'ees' (Explicit Estimation Search) additionally
+      uses an inadmissible but more accurate estimate hhat_fn: it prefers
+      the node nearest the goal among those whose g + hhat is within w of
+      the best g + hhat, as long as its f is within w of the smallest f,
+      then the best g + hhat node under the same test, and otherwise the
+      best f node.
+
+      C) class HeuristicCache
+
+      a bounded memo of a heuristic function. Wrapping heur_fn in a
+      HeuristicCache avoids scoring the same state (or, with a suitable
+      key function, the same part of a state) again, for example when a
+      state is re-expanded or when an anytime driver runs several searches
+      on the same problem. Hits and misses are reported in SearchStats.
+
       The main routines that the user will employ are in the SearchEngine class.
       These include the ability to set the search strategy, and to invoke
       search (using the init_search method) and resume the search after
       a goal is found (using searchOpen). See the implementation for details.
 
+      A search that ran out of time (or found a goal) can be continued by
+      calling search again on the same engine: OPEN, the closed list and the
+      counters are kept between calls. save_checkpoint writes all of that to
+      a file and load_checkpoint reads it into a new engine, so a long
+      search can also be run in chunks across separate processes:
+
+          se.init_search(state, goal_fn, heur_fn)
+          goal, stats = se.search(600)
+          se.save_checkpoint('level.ckpt')
+          ...
+          se = SearchEngine('astar')
+          se.load_checkpoint('level.ckpt', goal_fn, heur_fn)
+          goal, stats = se.search(600)
+
+      use_memory_tracking makes a search measure its memory every so many
+      expansions, either with tracemalloc (accurate, but it slows every
+      allocation down) or by estimating it from the numbers of states and
+      nodes made and the size of the closed list. The current and peak
+      bytes are reported in SearchStats. Given a soft limit, a callback is
+      made the first time a sample exceeds it, and can end the search (for
+      example to try a cheaper strategy).
+
     '''
+import asyncio
 import heapq
-from collections import deque
+from collections import deque, OrderedDict
 import os
+import pickle
+import sys
+import tracemalloc
+import zlib
+
+from closed_list import ClosedList
+
+# Rough size, in bytes, of the table slots of a dict closed list entry (not counting its
+# key), used by the 'estimate' memory tracking method.
+_DICT_ENTRY_BYTES = 50
+
+# Checkpoint files start with this magic, then a zlib compressed pickle.
+_CHECKPOINT_MAGIC = b'SCK4'
+
+# Bits in the filter of a PathKeys; more bits mean fewer walks of the path on a lookup.
+_PATH_FILTER_BITS = 1024
 
 
 class StateSpace:
     '''Abstract class for defining State spaces for search routines'''
     n = 0
+    # Successors that successors() recognised as dead ends (e.g. deadlocked
+    # Sokoban positions) and never generated. Reset at the start of each search.
+    dead_ends = 0
+    # Successors that successors() did not generate because they only reorder
+    # independent actions of a path already generated (partial order reduction).
+    # Reset at the start of each search.
+    reordered = 0
 
     def __init__(self, action, gval, parent):
         '''Problem specific state space objects must always include the data items
@@ -78,10 +168,28 @@ class StateSpace:
            if and only if obj1 and obj2 represent the same problem state.'''
         raise Exception("Must be overridden in subclass.")
 
+    def is_intermediate(self):
+        '''Returns True if self is only part way through an action, like a joint step of
+           several robots (operator decomposition) of which only some robots have
+           moved. Intermediate states are never recorded in the closed list of full
+           cycle checking.'''
+        return False
+
     def print_state(self):
         '''Print a representation of the state'''
         raise Exception("Must be overridden in subclass.")
 
+    def pack(self):
+        '''Only needed for external_bfs. Must return a bytes encoding of the state,
+           of the same length for every state of a problem, such that two states
+           have equal encodings if and only if they have equal hashable_state().'''
+        raise Exception("Must be overridden in subclass.")
+
+    def unpack(self, data, action, gval, parent):
+        '''Only needed for external_bfs. Must return the state of the same problem
+           encoded by data (a result of pack), with the given action, gval and parent.'''
+        raise Exception("Must be overridden in subclass.")
+
     def print_path(self):
         '''print the sequence of actions used to reach self'''
         # can be over ridden to print problem specific information
@@ -125,6 +233,8 @@ _BEST_FIRST = 2
 _ASTAR = 3
 _UCS = 4
 _CUSTOM = 5
+_FOCAL = 6
+_EES = 7
 
 # For best first and astar we use a priority queue. This requires
 # a comparison function for nodes. These constants indicate if we use
@@ -149,22 +259,195 @@ def _zero_hfn(state):
     return 0
 
 
+def _max_hfn(heuristics):
+    '''Returns a heuristic function whose value is the largest of those of heuristics.'''
+
+    def heur_max(state):
+        return max(heur_fn(state) for heur_fn in heuristics)
+
+    return heur_max
+
+
 def _fval_function(state):
     '''default fval function results in Best First Search'''
     return state.hval
 
 
+class HeuristicCache:
+    '''A heuristic function wrapper that memoizes at most capacity values.'''
+
+    def __init__(self, heur_fn, key_fn=None, capacity=100000, policy='lru'):
+        '''
+        @param heur_fn: the heuristic function to memoize.
+        @param key_fn: maps a state to the key its heuristic value is stored under. Defaults to
+                       hashable_state(), which is right for any heuristic. A heuristic that only
+                       depends on part of a state can use a key for just that part, so states
+                       that share it share one entry. A cache must only be used on one problem.
+        @param capacity: the most values kept.
+        @param policy: eviction policy once full, 'lru' (least recently used) or 'clock'
+                       (second chance, cheaper bookkeeping on hits).
+        '''
+        if policy not in ('lru', 'clock'):
+            raise Exception("Unknown heuristic cache policy {}, must be 'lru' or 'clock'".format(policy))
+        self.heur_fn = heur_fn
+        self.key_fn = key_fn
+        self.capacity = capacity
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        if policy == 'lru':
+            self.values = OrderedDict()
+        else:
+            self.values = dict()  # key -> slot
+            self.slot_keys = []
+            self.slot_values = []
+            self.referenced = []
+            self.hand = 0
+
+    def __call__(self, state):
+        key = state.hashable_state() if self.key_fn is None else self.key_fn(state)
+        if self.policy == 'lru':
+            values = self.values
+            if key in values:
+                self.hits = self.hits + 1
+                values.move_to_end(key)
+                return values[key]
+            self.misses = self.misses + 1
+            hval = self.heur_fn(state)
+            values[key] = hval
+            if len(values) > self.capacity:
+                values.popitem(last=False)
+            return hval
+
+        slot = self.values.get(key)
+        if slot is not None:
+            self.hits = self.hits + 1
+            self.referenced[slot] = True
+            return self.slot_values[slot]
+        self.misses = self.misses + 1
+        hval = self.heur_fn(state)
+        if len(self.slot_keys) < self.capacity:
+            self.values[key] = len(self.slot_keys)
+            self.slot_keys.append(key)
+            self.slot_values.append(hval)
+            self.referenced.append(False)
+            return hval
+        # sweep the clock hand, giving referenced entries a second chance.
+        while self.referenced[self.hand]:
+            self.referenced[self.hand] = False
+            self.hand = (self.hand + 1) % self.capacity
+        slot = self.hand
+        del self.values[self.slot_keys[slot]]
+        self.values[key] = slot
+        self.slot_keys[slot] = key
+        self.slot_values[slot] = hval
+        self.hand = (self.hand + 1) % self.capacity
+        return hval
+
+    def __len__(self):
+        return len(self.values)
+
+    def clear(self):
+        '''Forget every stored value (the hit and miss counts are kept).'''
+        self.__init__(self.heur_fn, self.key_fn, self.capacity, self.policy)
+
+
 class SearchStats:
 
-    def __init__(self, n1, n2, n3, n4, n5):
+    def __init__(self, n1, n2, n3, n4, n5, n6=0, closed_states=None, closed_load_factor=None):
         self.states_expanded = n1
         self.states_generated = n2
         self.states_pruned_cycles = n3
         self.states_pruned_cost = n4
         self.total_time = n5
+        self.states_pruned_deadlock = n6
+        # only reported when successors() pruned reorderings of independent actions.
+        self.states_pruned_reordering = None
+        # only reported when full cycle checking uses a compact ClosedList.
+        self.closed_states = closed_states
+        self.closed_load_factor = closed_load_factor
+        # only reported when the heuristic is a HeuristicCache.
+        self.heuristic_cache_hits = None
+        self.heuristic_cache_misses = None
+        # calls of heur_fn (of each heuristic, given a list). With lazy or deferred evaluation,
+        # also the nodes queued again once evaluated and the evaluations never made.
+        self.heuristic_evaluations = 0
+        self.nodes_requeued = None
+        self.heuristic_evaluations_skipped = None
+        # only reported by the bounded suboptimal strategies: the smallest f on OPEN when the
+        # goal was found, a lower bound on the optimal cost.
+        self.cost_lower_bound = None
+        # only reported with memory tracking on: bytes in use at the last sample, the most
+        # sampled, and how they were measured ('tracemalloc' or 'estimate').
+        self.memory_current = None
+        self.memory_peak = None
+        self.memory_method = None
 
     def __str__(self):
-        return f'states generated: {self.states_generated}\nstates explored: {self.states_expanded}\nstate pruned by cycle checking: {self.states_pruned_cycles}\nstates pruned by cost checking: {self.states_pruned_cost}\ntotal search time: {self.total_time}\n'
+        s = f'states generated: {self.states_generated}\nstates explored: {self.states_expanded}\nstate pruned by cycle checking: {self.states_pruned_cycles}\nstates pruned by cost checking: {self.states_pruned_cost}\nstates pruned by deadlock detection: {self.states_pruned_deadlock}\ntotal search time: {self.total_time}\n'
+        if self.states_pruned_reordering is not None:
+            s += f'states pruned by partial order reduction: {self.states_pruned_reordering}\n'
+        if self.closed_states is not None:
+            s += f'closed list states: {self.closed_states}\nclosed list load factor: {self.closed_load_factor:.3f}\n'
+        s += f'heuristic evaluations: {self.heuristic_evaluations}\n'
+        if self.nodes_requeued is not None:
+            s += f'nodes requeued after evaluation: {self.nodes_requeued}\n'
+            s += f'heuristic evaluations skipped: {self.heuristic_evaluations_skipped}\n'
+        if self.heuristic_cache_hits is not None:
+            s += f'heuristic cache hits: {self.heuristic_cache_hits}\nheuristic cache misses: {self.heuristic_cache_misses}\n'
+        if self.cost_lower_bound is not None:
+            s += f'optimal cost lower bound: {self.cost_lower_bound}\n'
+        if self.memory_peak is not None:
+            s += f'memory ({self.memory_method}): current {self.memory_current / 1e6:.1f} MB, peak {self.memory_peak / 1e6:.1f} MB\n'
+        return s
+
+
+class PathKeys:
+    '''The keys of the states on a path, as a list linked from the last state back to the
+       first. Paths that branch from the same state share it and everything before it, so
+       adding a state costs the same however long the path is. Each entry also holds a
+       bitmask with one bit set per key on the path (a Bloom filter), so a key whose bit is
+       not set is known to be off the path without walking it.'''
+
+    __slots__ = ('key', 'parent', 'bits')
+
+    def __init__(self, key, parent=None):
+        self.key = key
+        self.parent = parent
+        bit = 1 << (hash(key) % _PATH_FILTER_BITS)
+        self.bits = bit if parent is None else parent.bits | bit
+
+    def __contains__(self, key):
+        if not self.bits >> (hash(key) % _PATH_FILTER_BITS) & 1:
+            return False
+        entry = self
+        while entry is not None:
+            if entry.key == key:
+                return True
+            entry = entry.parent
+        return False
+
+    def keys(self):
+        '''Returns the keys on the path, first state first.'''
+        keys = []
+        entry = self
+        while entry is not None:
+            keys.append(entry.key)
+            entry = entry.parent
+        keys.reverse()
+        return keys
+
+    def __reduce__(self):
+        # pickled as the list of keys, since pickling the links would recurse once per state.
+        return _path_keys, (self.keys(),)
+
+
+def _path_keys(keys):
+    '''Returns the PathKeys of a list of keys (first state first), or None if it is empty.'''
+    path = None
+    for key in keys:
+        path = PathKeys(key, path)
+    return path
 
 
 class sNode:
@@ -176,6 +459,12 @@ class sNode:
 
     n = 0
     lt_type = _SUM_HG
+    # With path checking (other than depth first), the PathKeys of the states on the
+    # path to this node's parent, shared with the parent's other children (None if empty).
+    path_keys = None
+    # How many of the engine's heuristics are still to be evaluated on this node (lazy or
+    # deferred heuristic evaluation). Until none are, hval is not the node's final h.
+    pending = 0
 
     def __init__(self, state, hval, fval_function):
         self.state = state
@@ -224,47 +513,71 @@ class Open:
        strategy'''
 
     def __init__(self, search_strategy):
+        # a node put back on a priority queue OPEN, extracted before the others.
+        self.front = None
         if search_strategy == _DEPTH_FIRST:
             # use stack for OPEN set (last in---most recent successor added---is first out)
             self.open = []
             self.insert = self.open.append
             self.extract = self.open.pop
+            self.put_back = self.open.append
         elif search_strategy == _BREADTH_FIRST:
             # use queue for OPEN (first in---earliest node not yet expanded---is first out)
             self.open = deque()
             self.insert = self.open.append
             self.extract = self.open.popleft
+            self.put_back = self.open.appendleft
         elif search_strategy == _UCS:
             # use priority queue for OPEN (first out is node with lowest gval)
             self.open = []
             # set node less than function to compare gvals only
             sNode.lt_type = _G
             self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
+            self.extract = self._extract_heap
         elif search_strategy == _BEST_FIRST:
             # use priority queue for OPEN (first out is node with lowest hval)
             self.open = []
             # set node less than function to compare hvals only
             sNode.lt_type = _H
             self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
+            self.extract = self._extract_heap
         elif search_strategy == _ASTAR:
             # use priority queue for OPEN (first out is node with lowest fval = gval+hval)
             self.open = []
             # set node less than function to compare sums of hval and gval
             sNode.lt_type = _SUM_HG
             self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
+            self.extract = self._extract_heap
         elif search_strategy == _CUSTOM:
             # use priority queue for OPEN (first out is node with lowest fval)
             self.open = []
             # set node less than function to compare sums of fval
             sNode.lt_type = _C
             self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
+            self.extract = self._extract_heap
+
+    def _extract_heap(self):
+        node = self.front
+        if node is None:
+            return heapq.heappop(self.open)
+        self.front = None
+        return node
+
+    def put_back(self, node):
+        '''
+        Returns node, just extracted, to OPEN, to be extracted first again. It is held apart
+        rather than pushed on the heap again, which could reorder it among equal nodes.
+        '''
+        self.front = node
 
     def empty(self):
-        return not self.open
+        return not self.open and self.front is None
+
+    def nodes(self):
+        '''Returns the nodes on OPEN, in an order that inserting them again rebuilds it.'''
+        if self.front is not None:
+            return [self.front] + list(self.open)
+        return list(self.open)
 
     def print_open(self):
         print("{", end="")
@@ -281,16 +594,145 @@ class Open:
         print("}")
 
 
+class FocalOpen:
+    '''OPEN for the bounded suboptimal strategies. Nodes are kept in lazy heaps (entries
+       of expanded nodes are skipped when they reach the top):
+          by_f     every node, by f = g + h
+          by_fhat  every node, by fhat = g + hhat
+          focal    nodes with fhat within weight of the smallest fhat, by distance-to-go
+          waiting  the other nodes, by fhat
+       For 'focal', hhat is h, so fhat is f.'''
+
+    def __init__(self, weight, heur_fn, dist_fn=None, hhat_fn=None, explicit=False):
+        '''
+        @param weight: the suboptimality bound, at least 1.
+        @param heur_fn: the admissible heuristic (the engine's heur_fn).
+        @param dist_fn: distance-to-go estimate used to order FOCAL. Defaults to hhat_fn.
+        @param hhat_fn: inadmissible cost-to-go estimate (EES only). Defaults to heur_fn.
+        @param explicit: True for EES, False for focal search.
+        '''
+        if weight < 1:
+            raise Exception("The suboptimality bound must be at least 1, not {}".format(weight))
+        self.weight = weight
+        self.hhat_fn = hhat_fn if explicit else None
+        self.dist_fn = dist_fn
+        self.explicit = explicit
+        self.by_f = []
+        self.by_fhat = []
+        self.focal = []
+        self.waiting = []
+        self.size = 0
+        # smallest f on OPEN at the last extraction; a lower bound on the optimal cost.
+        self.f_min = 0
+
+    def insert(self, node):
+        hhat = node.hval if self.hhat_fn is None else self.hhat_fn(node.state)
+        node.fval = node.gval + node.hval
+        node.fhat = node.gval + hhat
+        node.dval = hhat if self.dist_fn is None else self.dist_fn(node.state)
+        node.removed = False
+        self.size = self.size + 1
+        heapq.heappush(self.by_f, (node.fval, -node.gval, node.index, node))
+        if self.explicit:
+            heapq.heappush(self.by_fhat, (node.fhat, -node.gval, node.index, node))
+        # a node may start in FOCAL only while it is certainly within the bound; extract
+        # moves nodes between FOCAL and waiting as the bound changes.
+        if node.fhat <= self.weight * self._top(self.by_fhat if self.explicit else self.by_f).fhat:
+            heapq.heappush(self.focal, (node.dval, node.fhat, node.index, node))
+        else:
+            heapq.heappush(self.waiting, (node.fhat, node.index, node))
+
+    def _top(self, heap):
+        '''Returns the first node of heap that is still on OPEN.'''
+        while heap[0][-1].removed:
+            heapq.heappop(heap)
+        return heap[0][-1]
+
+    def _best_focal(self, bound):
+        '''Returns the first node of FOCAL, for the current bound on fhat.'''
+        waiting = self.waiting
+        focal = self.focal
+        while waiting and (waiting[0][-1].removed or waiting[0][0] <= bound):
+            node = heapq.heappop(waiting)[-1]
+            if not node.removed:
+                heapq.heappush(focal, (node.dval, node.fhat, node.index, node))
+        while True:
+            node = focal[0][-1]
+            if node.removed:
+                heapq.heappop(focal)
+            elif node.fhat > bound:
+                # the bound went down (a node with a smaller fhat arrived); back to waiting.
+                heapq.heappop(focal)
+                heapq.heappush(waiting, (node.fhat, node.index, node))
+            else:
+                return node
+
+    def extract(self):
+        best_f = self._top(self.by_f)
+        self.f_min = best_f.fval
+        if not self.explicit:
+            node = self._best_focal(self.weight * best_f.fval)
+        else:
+            best_fhat = self._top(self.by_fhat)
+            best_d = self._best_focal(self.weight * best_fhat.fhat)
+            # f (not fhat) of the candidates against the bound, as in EES.
+            if best_d.fval <= self.weight * best_f.fval:
+                node = best_d
+            elif best_fhat.fval <= self.weight * best_f.fval:
+                node = best_fhat
+            else:
+                node = best_f
+        node.removed = True
+        self.size = self.size - 1
+        return node
+
+    def put_back(self, node):
+        '''Returns node, just extracted, to OPEN. Its heap entries are all still there.'''
+        node.removed = False
+        self.size = self.size + 1
+
+    def empty(self):
+        return self.size == 0
+
+    def nodes(self):
+        '''Returns the nodes on OPEN.'''
+        return [entry[-1] for entry in self.by_f if not entry[-1].removed]
+
+    def print_open(self):
+        print("{", end="")
+        for _, _, _, nd in sorted(self.by_f):
+            if not nd.removed:
+                print("   <S{}:{}:{}, g={}, h={}, f=g+h={}, d={}>".format(nd.state.index, nd.state.action,
+                                                                       nd.state.hashable_state(), nd.gval, nd.hval,
+                                                                       nd.fval, nd.dval), end="")
+        print("}")
+
+
 class SearchEngine:
     def __init__(self, strategy='depth_first', cc_level='default'):
         self.set_strategy(strategy, cc_level)
         self.trace = 0
+        self.closed_list_options = None
+        # print a message when a search stops at its time bound.
+        self.report_timeout = True
+        self.deferred_evaluation = False
+        self.memory_options = None
 
     def initStats(self):
         sNode.n = 0
         StateSpace.n = 1  # initial state already generated
+        StateSpace.dead_ends = 0
+        StateSpace.reordered = 0
         self.cycle_check_pruned = 0
         self.cost_bound_pruned = 0
+        self.heuristic_evaluations = 0
+        self.nodes_requeued = 0
+        # evaluations still pending on the nodes generated so far.
+        self.evaluations_pending = 0
+        self.memory_current = 0
+        self.memory_peak = 0
+        self.memory_limit_crossed = False
+        self.memory_sizes = None
 
     def trace_on(self, level=1):
         '''For debugging, set tracking level 1 or 2'''
@@ -300,10 +742,51 @@ class SearchEngine:
         '''Turn off tracing'''
         self.trace = 0
 
+    def use_closed_list(self, max_bytes=None, overflow='stop', gval_type='H'):
+        '''
+        Use a compact ClosedList (see closed_list.py) rather than a dict for full cycle
+        checking in the following searches.
+        @param max_bytes: Memory cap of the closed list, or None for no cap.
+        @param overflow: 'stop', 'drop' or 'raise' (what to do when it is full).
+        @param gval_type: array typecode used to store g-values at first (widened if one does not fit).
+        '''
+        self.closed_list_options = dict(max_bytes=max_bytes, overflow=overflow, gval_type=gval_type)
+
+    def use_dict_closed_list(self):
+        '''Go back to the default dict for full cycle checking.'''
+        self.closed_list_options = None
+
+    def use_deferred_evaluation(self, deferred=True):
+        '''
+        Turn deferred heuristic evaluation on (or off) for the following searches. It only
+        applies to the ucs, best_first, astar and custom strategies.
+        '''
+        self.deferred_evaluation = deferred
+
+    def use_memory_tracking(self, every=1000, method='tracemalloc', soft_limit=None, callback=None):
+        '''
+        Measure the memory used by the following searches every so many expansions.
+        @param every: Expansions between samples, or None to turn memory tracking off.
+        @param method: 'tracemalloc' measures the memory allocated while the search runs (tracing
+                       is started for each call of search unless it is already on, and slows it
+                       down); 'estimate' counts states, nodes and closed list entries, costs
+                       next to nothing and usually comes out somewhat high.
+        @param soft_limit: Bytes above which callback is called (once per search).
+        @param callback: Called as callback(engine, current_bytes) when a sample first exceeds
+                         soft_limit. If it returns True the search stops, as if out of time.
+        '''
+        if every is None:
+            self.memory_options = None
+            return
+        if method not in ('tracemalloc', 'estimate'):
+            raise Exception("Unknown memory tracking method {}, must be 'tracemalloc' or 'estimate'".format(method))
+        self.memory_options = dict(every=every, method=method, soft_limit=soft_limit, callback=callback)
+
     def set_strategy(self, s, cc='default'):
-        if not s in ['depth_first', 'breadth_first', 'ucs', 'best_first', 'astar', 'custom']:
+        if not s in ['depth_first', 'breadth_first', 'ucs', 'best_first', 'astar', 'custom', 'focal', 'ees']:
             print('Unknown search strategy specified:', s)
-            print("Must be one of 'depth_first', 'ucs', 'breadth_first', 'best_first', 'custom' or 'astar'")
+            print("Must be one of 'depth_first', 'ucs', 'breadth_first', 'best_first', 'custom', 'astar', "
+                  "'focal' or 'ees'")
         elif not cc in ['default', 'none', 'path', 'full']:
             print('Unknown cycle check level', cc)
             print("Must be one of ['default', 'none', 'path', 'full']")
@@ -333,6 +816,10 @@ class SearchEngine:
                 self.strategy = _ASTAR
             elif s == 'custom':
                 self.strategy = _CUSTOM
+            elif s == 'focal':
+                self.strategy = _FOCAL
+            elif s == 'ees':
+                self.strategy = _EES
 
     def get_strategy(self):
         if self.strategy == _DEPTH_FIRST:
@@ -347,6 +834,10 @@ class SearchEngine:
             rval = 'astar'
         elif self.strategy == _CUSTOM:
             rval = 'custom'
+        elif self.strategy == _FOCAL:
+            rval = 'focal'
+        elif self.strategy == _EES:
+            rval = 'ees'
 
         rval = rval + ' with '
 
@@ -359,14 +850,20 @@ class SearchEngine:
 
         return rval
 
-    def init_search(self, initState, goal_fn, heur_fn=_zero_hfn, fval_function=_fval_function):
+    def init_search(self, initState, goal_fn, heur_fn=_zero_hfn, fval_function=_fval_function, weight=1,
+                    dist_fn=None, hhat_fn=None):
         """
         Get ready to search. Call search on this object to run the search.
 
         @param initState: the state of the puzzle to start the search from.
         @param goal_fn: the goal function for the puzzle
-        @param heur_fn: the heuristic function to use (only relevant for search strategies that use heuristics)
+        @param heur_fn: the heuristic function to use (only relevant for search strategies that use heuristics),
+                        or a list of admissible heuristic functions, cheapest first, to be evaluated lazily
         @param fval_fn: the f-value function (only relevant for custom search strategy)
+        @param weight: the suboptimality bound (only relevant for focal and ees)
+        @param dist_fn: the distance-to-go estimate ordering FOCAL (only relevant for focal and ees).
+                        Defaults to hhat_fn for ees and heur_fn for focal.
+        @param hhat_fn: an inadmissible, more accurate, heuristic (only relevant for ees). Defaults to heur_fn.
         """
         # Perform full cycle checking as follows
         # a. check state before inserting into OPEN. If we had already reached
@@ -379,6 +876,7 @@ class SearchEngine:
         #   expensive path, we re-expand it.
 
         self.initStats()
+        heur_fn = self._set_heuristics(heur_fn)
 
         # BEGIN TRACING
         if self.trace:
@@ -386,48 +884,428 @@ class SearchEngine:
             print("   TRACE: Initial State:", end="")
             initState.print_state()
         # END
-        self.open = Open(self.strategy)
+        self._new_open(heur_fn, weight, dist_fn, hhat_fn)
 
         node = sNode(initState, heur_fn(initState), fval_function)
+        self.heuristic_evaluations = len(self.heuristics)
 
         # the cycle check dictionary stores the cheapest path (g-val) found
         # so far to a state.
         if self.cycle_check == _CC_FULL:
-            self.cc_dictionary = dict()
+            if self.closed_list_options is None:
+                self.cc_dictionary = dict()
+            else:
+                self.cc_dictionary = ClosedList(**self.closed_list_options)
             self.cc_dictionary[initState.hashable_state()] = initState.gval
 
+        # Path checking keeps the keys of the states on the current path in a set,
+        # so checking a successor is one lookup rather than a walk up its ancestors.
+        # Depth first search updates a single set as it descends and backtracks;
+        # other strategies give each node the PathKeys of its parent's path, whose
+        # tails are shared, so no node copies the path.
+        if self.cycle_check == _CC_PATH:
+            ancestors = []
+            s = initState.parent
+            while s:
+                ancestors.append((s, s.hashable_state()))
+                s = s.parent
+            ancestors.reverse()
+            self.path_stack = ancestors
+            self.path_set = set(key for _, key in ancestors)
+            node.path_keys = _path_keys(key for _, key in ancestors)
+
         self.open.insert(node)
         self.fval_function = fval_function
         self.goal_fn = goal_fn
         self.heur_fn = heur_fn
+        self._save_counters()
 
-    def search(self, timebound=None, costbound=None):
+    def _set_heuristics(self, heur_fn):
+        '''
+        Records the heuristic (or list of heuristics) of a new search. Returns the heuristic
+        function giving a state its full h.
+        '''
+        if isinstance(heur_fn, (list, tuple)):
+            if not heur_fn:
+                raise Exception("The list of heuristics is empty")
+            self.heuristics = tuple(heur_fn)
+            heur_fn = self.heuristics[0] if len(self.heuristics) == 1 else _max_hfn(self.heuristics)
+        else:
+            self.heuristics = (heur_fn,)
+        # caches may be shared with other searches; only count this one's lookups.
+        self.heuristic_cache_start = self._heuristic_cache_counts()
+        return heur_fn
+
+    def _heuristic_cache_counts(self):
+        '''Returns the total hits and misses of the heuristics that are HeuristicCaches, or None.'''
+        caches = [h for h in self.heuristics if isinstance(h, HeuristicCache)]
+        if not caches:
+            return None
+        return sum(cache.hits for cache in caches), sum(cache.misses for cache in caches)
+
+    def _new_open(self, heur_fn, weight=1, dist_fn=None, hhat_fn=None):
+        if self.strategy in (_FOCAL, _EES):
+            self.open = FocalOpen(weight, heur_fn, dist_fn, hhat_fn, self.strategy == _EES)
+        else:
+            self.open = Open(self.strategy)
+
+    def _save_counters(self):
+        '''Remembers the class-wide counters (and node ordering) of this engine's search.'''
+        self.counters = (sNode.n, StateSpace.n, StateSpace.dead_ends, StateSpace.reordered, sNode.lt_type)
+
+    def _restore_counters(self):
+        '''Puts back this engine's class-wide counters, in case another search ran in between.'''
+        sNode.n, StateSpace.n, StateSpace.dead_ends, StateSpace.reordered, sNode.lt_type = self.counters
+
+    def search(self, timebound=None, costbound=None, expansion_bound=None):
         """
         Start searching, using the parameters set by init_search.
 
         @param timebound: the maximum amount of time, in seconds, to spend on this search.
         @param costbound: the cost bound 3-tuple for pruning, as specified in the assignment.
+        @param expansion_bound: the maximum number of nodes to expand in this call.
 
         This code will return a goal path (if one is found) as well as a SearchStat object containing
         statistics about the given search (assuming a solution is found).
+
+        Calling search again continues from where the previous call stopped (after running out
+        of time, or after finding a goal). The bounds are checked after a node taken off OPEN is
+        goal tested, as they always were, so a goal at the front of OPEN is returned even when the
+        time is up. The counts in the returned SearchStats are totals since init_search; the time
+        is that of this call.
         """
 
         ###NOW do the search and return the result
+        self._restore_counters()
         self.search_start_time = os.times()[0]
         self.search_stop_time = None
         if timebound:
             self.search_stop_time = self.search_start_time + timebound
-
-        goal_node = self._searchOpen(self.goal_fn, self.heur_fn, self.fval_function, costbound)
+        self.expansion_bound = expansion_bound
+        self.expansions = 0
+
+        tracing = self.memory_options is not None and self.memory_options['method'] == 'tracemalloc' and \
+            not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        try:
+            goal_node = self._searchOpen(self.goal_fn, self.heur_fn, self.fval_function, costbound)
+            if self.memory_options is not None:
+                self._sample_memory()
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        self._save_counters()
 
         total_search_time = os.times()[0] - self.search_start_time
-        stats = SearchStats(sNode.n, StateSpace.n, self.cycle_check_pruned, self.cost_bound_pruned, total_search_time)
+        stats = SearchStats(sNode.n, StateSpace.n, self.cycle_check_pruned, self.cost_bound_pruned, total_search_time,
+                            StateSpace.dead_ends)
+        stats.heuristic_evaluations = self.heuristic_evaluations
+        if StateSpace.reordered:
+            stats.states_pruned_reordering = StateSpace.reordered
+        if self._deferring() or self._lazy():
+            stats.nodes_requeued = self.nodes_requeued
+            stats.heuristic_evaluations_skipped = self.evaluations_pending
+        if self.cycle_check == _CC_FULL and isinstance(self.cc_dictionary, ClosedList):
+            stats.closed_states = len(self.cc_dictionary)
+            stats.closed_load_factor = self.cc_dictionary.load_factor()
+        if self.heuristic_cache_start is not None:
+            hits, misses = self._heuristic_cache_counts()
+            stats.heuristic_cache_hits = hits - self.heuristic_cache_start[0]
+            stats.heuristic_cache_misses = misses - self.heuristic_cache_start[1]
+        if goal_node and self.strategy in (_FOCAL, _EES):
+            stats.cost_lower_bound = self.open.f_min
+        if self.memory_options is not None:
+            stats.memory_current = self.memory_current
+            stats.memory_peak = self.memory_peak
+            stats.memory_method = self.memory_options['method']
 
         if goal_node:
             return goal_node.state, stats
         else:  # exited the while without finding goal---search failed
             return False, stats
 
+    def iter_solutions(self, timebound=None, costbound=None):
+        '''
+        Anytime search: continues the search set up by init_search, yielding (goal state, SearchStats)
+        every time a goal cheaper than all those yielded before is found. OPEN is kept between
+        goals, so stopping early (e.g. once a goal is good enough) wastes nothing, and successors
+        costing more than the best goal yielded so far are pruned.
+
+        @param timebound: the maximum amount of time, in seconds, to spend over all the goals.
+        @param costbound: the cost bound 3-tuple for pruning, as for search.
+
+        The counts in each SearchStats are totals since init_search, the time is that since the
+        generator started.
+        '''
+        start = os.times()[0]
+        best = float('inf')
+        while not self.open.empty():
+            remaining = None
+            if timebound:
+                remaining = start + timebound - os.times()[0]
+                if remaining <= 0:
+                    return
+            goal, stats = self.search(remaining, self._incumbent_bound(costbound, best))
+            if not goal:
+                return
+            if goal.gval < best:
+                best = goal.gval
+                stats.total_time = os.times()[0] - start
+                yield goal, stats
+
+    async def aiter_solutions(self, timebound=None, costbound=None, time_slice=0.05):
+        '''
+        As iter_solutions, but an asynchronous generator: the search runs in steps of at most
+        time_slice seconds and lets other asyncio tasks run between them.
+        '''
+        start = os.times()[0]
+        best = float('inf')
+        report_timeout = self.report_timeout
+        self.report_timeout = False
+        try:
+            while not self.open.empty():
+                step = time_slice
+                if timebound:
+                    remaining = start + timebound - os.times()[0]
+                    if remaining <= 0:
+                        return
+                    step = min(step, remaining)
+                goal, stats = self.search(step, self._incumbent_bound(costbound, best))
+                if goal and goal.gval < best:
+                    best = goal.gval
+                    stats.total_time = os.times()[0] - start
+                    self.report_timeout = report_timeout
+                    yield goal, stats
+                    self.report_timeout = False
+                await asyncio.sleep(0)
+        finally:
+            self.report_timeout = report_timeout
+
+    def _sample_memory(self):
+        '''Measures the memory in use. Returns True if the soft limit callback asks to stop.'''
+        options = self.memory_options
+        if options['method'] == 'tracemalloc':
+            self.memory_current, peak = tracemalloc.get_traced_memory()
+        else:
+            self.memory_current = peak = self._estimate_memory()
+        self.memory_peak = max(self.memory_peak, peak)
+        if options['soft_limit'] is not None and not self.memory_limit_crossed and \
+                self.memory_current > options['soft_limit']:
+            self.memory_limit_crossed = True
+            if options['callback'] is not None and options['callback'](self, self.memory_current):
+                print("TRACE: Search has exceeded the soft memory limit.")
+                return True
+        return False
+
+    def _estimate_memory(self):
+        '''
+        Estimates the bytes used by the search: a state and a node for every node made so far
+        (states that were pruned before a node was made for them are freed; expanded nodes are
+        too, but their states are kept by their children's parent pointers) and the closed list.
+        '''
+        if self.memory_sizes is None:
+            # sizes of a state, a node and a closed list key, taken from a node on OPEN. Only
+            # the fields of a state that it does not share with its parent (the level's
+            # obstacles, say) are counted.
+            node = next((node for node in self.open.nodes() if node.state.parent is not None), None)
+            if node is None:
+                return 0
+            state = node.state
+            parent_fields = state.parent.__dict__
+            state_bytes = sys.getsizeof(state) + sys.getsizeof(state.__dict__) + sum(
+                sys.getsizeof(value) for name, value in state.__dict__.items()
+                if name != 'parent' and value is not parent_fields.get(name))
+            node_bytes = sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+            key_bytes = sys.getsizeof(state.hashable_state()) + _DICT_ENTRY_BYTES
+            self.memory_sizes = (state_bytes, node_bytes, key_bytes)
+        state_bytes, node_bytes, key_bytes = self.memory_sizes
+        used = sNode.n * (state_bytes + node_bytes)
+        if self.cycle_check == _CC_FULL:
+            if isinstance(self.cc_dictionary, ClosedList):
+                used = used + self.cc_dictionary.nbytes()
+            else:
+                used = used + len(self.cc_dictionary) * key_bytes
+        return used
+
+    def _deferring(self):
+        '''True if this search defers heuristic evaluation.'''
+        return self.deferred_evaluation and self.strategy in (_UCS, _BEST_FIRST, _ASTAR, _CUSTOM)
+
+    def _lazy(self):
+        '''True if this search evaluates a list of heuristics lazily.'''
+        return len(self.heuristics) > 1 and self.strategy in (_UCS, _BEST_FIRST, _ASTAR, _CUSTOM)
+
+    def _incumbent_bound(self, costbound, best):
+        '''Returns costbound, tightened so that nothing costing best or more is generated.'''
+        if best == float('inf'):
+            return costbound
+        if costbound is None:
+            return (best, float('inf'), float('inf'))
+        return (min(costbound[0], best), costbound[1], costbound[2])
+
+    def save_checkpoint(self, path):
+        '''
+        Writes the state of the search (OPEN, the closed list, the path checking state and the
+        counters) to the file at path, to be continued later with load_checkpoint. The states are
+        pickled, so their classes must be importable when the checkpoint is loaded. The closed
+        list holds hashable_state() values, so the checkpoint must be loaded by the same Python
+        version (hash() of tuples differs between versions).
+        '''
+        # Every state is stored once, with the position of its parent, rather than
+        # pickling the (deep) parent chains. States share their parents, and most of
+        # them also share the level's storage and obstacles, which pickle stores once.
+        positions = dict()
+        states = []
+
+        def position(state):
+            chain = []
+            while state is not None and id(state) not in positions:
+                chain.append(state)
+                state = state.parent
+            for st in reversed(chain):
+                fields = dict(st.__dict__)
+                parent = fields.pop('parent')
+                positions[id(st)] = len(states)
+                states.append((type(st), fields, -1 if parent is None else positions[id(parent)]))
+            return positions[id(chain[0])] if chain else positions[id(state)]
+
+        nodes = [(position(node.state), node.hval, node.index, node.path_keys, node.pending)
+                 for node in self.open.nodes()]
+        path_stack = None
+        if self.cycle_check == _CC_PATH and self.strategy == _DEPTH_FIRST:
+            path_stack = [(position(st), key) for st, key in self.path_stack]
+        checkpoint = dict(
+            python=sys.version_info[:2],
+            strategy=self.strategy,
+            cycle_check=self.cycle_check,
+            weight=getattr(self.open, 'weight', 1),
+            states=states,
+            nodes=nodes,
+            path_stack=path_stack,
+            closed=self.cc_dictionary if self.cycle_check == _CC_FULL else None,
+            counters=self.counters,
+            pruned=(self.cycle_check_pruned, self.cost_bound_pruned),
+            evaluations=(self.heuristic_evaluations, self.nodes_requeued, self.evaluations_pending),
+        )
+        data = zlib.compress(pickle.dumps(checkpoint, pickle.HIGHEST_PROTOCOL))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(_CHECKPOINT_MAGIC)
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def load_checkpoint(self, path, goal_fn, heur_fn=_zero_hfn, fval_function=_fval_function, dist_fn=None,
+                        hhat_fn=None):
+        '''
+        Restores a search written by save_checkpoint, in place of init_search. The strategy and
+        cycle checking level are those of the saved search. Functions cannot be saved, so they are
+        given again, as for init_search; they should be the ones the search was started with.
+        '''
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(_CHECKPOINT_MAGIC)] != _CHECKPOINT_MAGIC:
+            raise Exception("{} is not a search checkpoint".format(path))
+        checkpoint = pickle.loads(zlib.decompress(data[len(_CHECKPOINT_MAGIC):]))
+        if checkpoint['python'] != sys.version_info[:2]:
+            raise Exception("Checkpoint {} was written by Python {}.{}".format(path, *checkpoint['python']))
+
+        self.strategy = checkpoint['strategy']
+        self.cycle_check = checkpoint['cycle_check']
+        self.initStats()
+        heur_fn = self._set_heuristics(heur_fn)
+        self.cycle_check_pruned, self.cost_bound_pruned = checkpoint['pruned']
+        self.heuristic_evaluations, self.nodes_requeued, self.evaluations_pending = checkpoint['evaluations']
+
+        states = []
+        for cls, fields, parent in checkpoint['states']:
+            st = cls.__new__(cls)
+            st.__dict__.update(fields)
+            st.parent = states[parent] if parent >= 0 else None
+            states.append(st)
+
+        self._new_open(heur_fn, checkpoint['weight'], dist_fn, hhat_fn)
+        for position, hval, index, path_keys, pending in checkpoint['nodes']:
+            node = sNode(states[position], hval, fval_function)
+            node.index = index
+            node.path_keys = path_keys
+            node.pending = pending
+            self.open.insert(node)
+        if self.cycle_check == _CC_FULL:
+            self.cc_dictionary = checkpoint['closed']
+        if self.cycle_check == _CC_PATH:
+            self.path_stack = [(states[position], key) for position, key in checkpoint['path_stack'] or ()]
+            self.path_set = set(key for _, key in self.path_stack)
+
+        self.fval_function = fval_function
+        self.goal_fn = goal_fn
+        self.heur_fn = heur_fn
+        # the node ordering comes from the new OPEN, the counts from the checkpoint.
+        self.counters = checkpoint['counters'][:4] + (sNode.lt_type,)
+
+    def _evaluate(self, node, costbound):
+        '''
+        Evaluates the heuristics still pending on node, just taken off OPEN, in order. As soon as
+        its h makes node worse than the best node left on OPEN it is put back, and the remaining
+        heuristics wait until it comes off OPEN again. Returns True if node is to be expanded now.
+        '''
+        heuristics = self.heuristics
+        while node.pending:
+            k = len(heuristics) - node.pending
+            hval = heuristics[k](node.state)
+            node.pending = node.pending - 1
+            self.heuristic_evaluations = self.heuristic_evaluations + 1
+            self.evaluations_pending = self.evaluations_pending - 1
+            # the first heuristic replaces a deferred node's provisional h; the others only raise h.
+            node.hval = hval if k == 0 else max(node.hval, hval)
+            if costbound is not None and (node.hval > costbound[1] or node.gval + node.hval > costbound[2]):
+                self.cost_bound_pruned = self.cost_bound_pruned + 1
+                return False
+            if not self.open.empty() and self.open.open[0] < node:
+                self.open.insert(node)
+                self.nodes_requeued = self.nodes_requeued + 1
+                return False
+        return True
+
+    def _enter_path(self, node):
+        '''
+        Called when node is about to be expanded with path checking on. Returns the keys of
+        node's state and all its ancestors (a set, or a PathKeys), for membership tests.
+        '''
+        key = node.state.hashable_state()
+        if self.strategy != _DEPTH_FIRST:
+            return PathKeys(key, node.path_keys)
+
+        # depth first: backtrack the path to node's parent, then descend to node.
+        parent = node.state.parent
+        stack = self.path_stack
+        while stack and stack[-1][0] is not parent:
+            self.path_set.discard(stack.pop()[1])
+        if not stack and parent is not None:
+            # parent was not on the current path (e.g. the search was seeded with it); rebuild.
+            s = parent
+            while s:
+                stack.append((s, s.hashable_state()))
+                s = s.parent
+            stack.reverse()
+            self.path_set = set(k for _, k in stack)
+        stack.append((node.state, key))
+        self.path_set.add(key)
+        return self.path_set
+
+    def _out_of_bounds(self):
+        '''True if the search must stop: it is over its time bound or expansion bound, or the closed list is full.'''
+        if self.search_stop_time:  # timebound check
+            if os.times()[0] > self.search_stop_time:
+                # exceeded time bound, must terminate search
+                if self.report_timeout:
+                    print("TRACE: Search has exceeeded the time bound provided.")
+                return True
+        if self.cycle_check == _CC_FULL and getattr(self.cc_dictionary, 'full', False):
+            # the compact closed list is at its memory cap, must terminate search
+            print("TRACE: Search has filled the closed list.")
+            return True
+        return self.expansion_bound is not None and self.expansions >= self.expansion_bound
+
     def _searchOpen(self, goal_fn, heur_fn, fval_function, costbound):
         """
         Search, starting from self.open.
@@ -443,6 +1321,8 @@ class SearchEngine:
             if self.cycle_check == _CC_FULL:
                 print("   TRACE: Initial CC_Dict:", self.cc_dictionary)
         # END TRACING
+        deferred = self._deferring()
+        lazy = self._lazy()
         while not self.open.empty():
             node = self.open.extract()
 
@@ -457,11 +1337,12 @@ class SearchEngine:
             if goal_fn(node.state):
                 # node at front of OPEN is a goal...search is completed.
                 return node
-            if self.search_stop_time:  # timebound check
-                if os.times()[0] > self.search_stop_time:
-                    # exceeded time bound, must terminate search
-                    print("TRACE: Search has exceeeded the time bound provided.")
-                    return False
+            # The bounds are checked after the goal test, so a goal at the front of OPEN is
+            # returned even once they are reached. A search stopped by them puts node back,
+            # so that it can be continued exactly where it stopped.
+            if self._out_of_bounds():
+                self.open.put_back(node)
+                return False
 
             # All states reached by a search node on OPEN have already
             # been hashed into the self.cc_dictionary. However,
@@ -473,12 +1354,25 @@ class SearchEngine:
             # BEGIN TRACING
             if self.trace:
                 if self.cycle_check == _CC_FULL: print("   TRACE: CC_dict gval={}, node.gval={}".format(
-                    self.cc_dictionary[node.state.hashable_state()], node.gval))
+                    self.cc_dictionary.get(node.state.hashable_state()), node.gval))
             # END TRACING
 
-            if self.cycle_check == _CC_FULL and self.cc_dictionary[node.state.hashable_state()] < node.gval:
+            if self.cycle_check == _CC_FULL and \
+                    self.cc_dictionary.get(node.state.hashable_state(), node.gval) < node.gval:
                 continue
 
+            # A node's h is only worked out in full here, so that goals and nodes reached more
+            # cheaply are not evaluated (a goal's h is 0, so its provisional f is already exact).
+            if node.pending and not self._evaluate(node, costbound):
+                continue
+
+            if self.cycle_check == _CC_PATH:
+                path_keys = self._enter_path(node)
+
+            self.expansions = self.expansions + 1
+            if self.memory_options is not None and self.expansions % self.memory_options['every'] == 0 and \
+                    self._sample_memory():
+                return False
             successors = node.state.successors()
 
             # BEGIN TRACING
@@ -507,16 +1401,16 @@ class SearchEngine:
                         print("   TRACE: Already in CC_dict, CC_dict gval={}, successor state gval={}".format(
                             self.cc_dictionary[hash_state], succ.gval))
 
-                    if self.cycle_check == _CC_PATH and succ.has_path_cycle():
+                    if self.cycle_check == _CC_PATH and hash_state in path_keys:
                         print("   TRACE: On cyclic path")
                 # END TRACING
 
-                prune_succ = (self.cycle_check == _CC_FULL and
-                              hash_state in self.cc_dictionary and
-                              succ.gval > self.cc_dictionary[hash_state]
+                full_check = self.cycle_check == _CC_FULL and not succ.is_intermediate()
+                prune_succ = (full_check and
+                              succ.gval > self.cc_dictionary.get(hash_state, succ.gval)
                               ) or (
                                      self.cycle_check == _CC_PATH and
-                                     succ.has_path_cycle()
+                                     hash_state in path_keys
                              )
 
                 if prune_succ:
@@ -528,10 +1422,23 @@ class SearchEngine:
                         # END TRACING
                     continue
 
-                succ_hval = heur_fn(succ)
-                if costbound is not None and (succ.gval > costbound[0] or
-                                              succ_hval > costbound[1] or
-                                              succ.gval + succ_hval > costbound[2]):
+                pending = 0
+                if deferred and self.strategy == _ASTAR:
+                    # the parent's f, which a consistent heuristic never exceeds.
+                    succ_hval = max(node.hval - (succ.gval - node.gval), 0)
+                    pending = len(self.heuristics)
+                elif deferred:
+                    succ_hval = node.hval
+                    pending = len(self.heuristics)
+                elif lazy:
+                    succ_hval = self.heuristics[0](succ)
+                    self.heuristic_evaluations = self.heuristic_evaluations + 1
+                    pending = len(self.heuristics) - 1
+                else:
+                    succ_hval = heur_fn(succ)
+                    self.heuristic_evaluations = self.heuristic_evaluations + len(self.heuristics)
+                if costbound is not None and (succ.gval > costbound[0] or not deferred and (
+                        succ_hval > costbound[1] or succ.gval + succ_hval > costbound[2])):
                     self.cost_bound_pruned = self.cost_bound_pruned + 1
                     if self.trace > 1:
                         print(" TRACE: Successor State pruned, over current cost bound of {}", costbound)
@@ -539,7 +1446,13 @@ class SearchEngine:
                     continue
 
                     # passed all cycle checks and costbound checks ...add to open
-                self.open.insert(sNode(succ, succ_hval, node.fval_function))
+                succ_node = sNode(succ, succ_hval, node.fval_function)
+                if pending:
+                    succ_node.pending = pending
+                    self.evaluations_pending = self.evaluations_pending + pending
+                if self.cycle_check == _CC_PATH and self.strategy != _DEPTH_FIRST:
+                    succ_node.path_keys = path_keys
+                self.open.insert(succ_node)
 
                 # BEGIN TRACING
                 if self.trace > 1:
@@ -548,7 +1461,7 @@ class SearchEngine:
                 # END TRACING
 
                 # record cost of this path in dictionary.
-                if self.cycle_check == _CC_FULL:
+                if full_check:
                     self.cc_dictionary[hash_state] = succ.gval
 
         # end of while--OPEN is empty and no solution
@@ -6,10 +6,45 @@
     Code also contains a list of 20 Sokoban problems for the purpose of testing.
 '''
 
+import struct
+
 from search import *
+import deadlock
+import macros
 
 
 class SokobanState(StateSpace):
+    # Opt-in robot symmetry reduction. Robots are interchangeable, so when this is
+    # True states are keyed on the multiset of robot positions and states that only
+    # differ by which robot stands where are treated as the same state.
+    robot_symmetry = False
+    # Opt-in deadlock detection: discard successors that deadlock.is_deadlock() proves
+    # unsolvable. They are counted in StateSpace.dead_ends instead of being generated.
+    deadlock_detection = False
+    # Opt-in macro moves (see macros.py): pushes into tunnels and goal rooms are
+    # continued as one successor, whose moves are kept in macro.
+    macro_moves = False
+    # (robot, direction indices) of the moves a macro successor was made of, else None.
+    # A wait of operator decomposition is a macro of no moves.
+    macro = None
+    # Opt-in operator decomposition: the robots take turns, in index order, each moving
+    # or waiting (at no cost) within a joint step, so a state has the successors of one
+    # robot only. States part way through a joint step are intermediate and are kept
+    # out of the closed list; od_index is the robot whose turn it is and od_moved
+    # whether any robot has moved in the step yet (a step of waits only is not allowed).
+    operator_decomposition = False
+    od_index = 0
+    od_moved = False
+    # Opt-in partial order reduction. Two moves of different robots that touch disjoint
+    # squares (the robot's square, its target and, for a push, the box's new square)
+    # can be made in either order with the same result, so only the order moving the
+    # lower numbered robot first is generated; the other is counted in
+    # StateSpace.reordered. Any plan can be reordered this way at the same cost. It is
+    # not applied together with macro moves, operator decomposition or robot symmetry.
+    partial_order_reduction = False
+    # (robot, bitmask of the squares touched) of the move that made this state, kept for
+    # partial order reduction.
+    last_move = None
 
     def __init__(self, action, gval, parent, width, height, robots, boxes, storage, obstacles):
         '''
@@ -35,61 +70,170 @@ class SokobanState(StateSpace):
         '''
         successors = []
         transition_cost = 1
-        moved_boxes = frozenset()
-
-        for robot in range(0, len(self.robots)):
-            for direction in (UP, RIGHT, DOWN, LEFT):
-                new_location = direction.move(self.robots[robot])
-                new_robots = list(self.robots);
-                new_robots.remove(self.robots[robot])
-                new_robots = tuple(new_robots)
-                new_boxes = set(self.boxes)
-                new_moved_boxes = set(moved_boxes)
-
-                if new_location[0] < 0 or new_location[0] >= self.width:
-                    continue
-                if new_location[1] < 0 or new_location[1] >= self.height:
-                    continue
-                if new_location in self.obstacles:
-                    continue
-                if new_location in new_robots:
-                    continue
-                if new_location in moved_boxes:
+        table = move_table(self.width, self.height, self.obstacles)
+        bits = table.bits
+        names = action_names(len(self.robots))
+        robots = self.robots
+        boxes = self.boxes
+
+        robot_mask = 0
+        for location in robots:
+            robot_mask |= bits[location]
+        box_mask = 0
+        for location in boxes:
+            box_mask |= bits[location]
+        blocked = robot_mask | box_mask
+
+        reduce = SokobanState.partial_order_reduction and not (
+            SokobanState.macro_moves or SokobanState.operator_decomposition or SokobanState.robot_symmetry)
+        last_robot, last_touched = self.last_move if reduce and self.last_move else (0, 0)
+
+        turns = enumerate(robots)
+        if SokobanState.operator_decomposition:
+            robot = self.od_index
+            turns = ((robot, robots[robot]),)
+            next_index = (robot + 1) % len(robots)
+            if next_index or self.od_moved:
+                wait = SokobanState(str(robot) + " wait", self.gval, self, self.width, self.height, robots, boxes,
+                                    self.storage, self.obstacles)
+                wait.macro = (robot, ())
+                wait.od_index = next_index
+                wait.od_moved = self.od_moved and next_index != 0
+                successors.append(wait)
+
+        for robot, location in turns:
+            for d, target, target_bit, beyond, beyond_bit in table.moves[location]:
+                if target_bit & robot_mask:
                     continue
 
-                if new_location in self.boxes:
-                    new_box_location = direction.move(new_location)
-
-                    if new_box_location[0] < 0 or new_box_location[0] >= self.width:
-                        continue
-                    if new_box_location[1] < 0 or new_box_location[1] >= self.height:
-                        continue
-                    if new_box_location in self.obstacles:
-                        continue
-                    if new_box_location in new_robots:
-                        continue
-                    if new_box_location in new_boxes:
+                new_boxes = boxes
+                touched = bits[location] | target_bit
+                if target_bit & box_mask:
+                    if not beyond_bit or beyond_bit & blocked:
                         continue
+                    new_boxes = boxes.difference((target,)).union((beyond,))
+                    touched |= beyond_bit
 
-                    new_boxes.remove(new_location)
-                    new_boxes.add(new_box_location)
-                    new_moved_boxes.add(new_box_location)
+                if robot < last_robot and not touched & last_touched:
+                    # the same as making this move before the last one.
+                    StateSpace.reordered = StateSpace.reordered + 1
+                    continue
 
-                new_robots = list(self.robots)
-                new_robots[robot] = new_location
-                new_robots = tuple(new_robots)
+                new_robots = robots[:robot] + (target,) + robots[robot + 1:]
+                macro = None
+                if new_boxes is not boxes and SokobanState.macro_moves:
+                    macro = macros.extend_push(self.width, self.height, self.obstacles, self.storage, new_robots,
+                                               robot, d, new_boxes, beyond)
+                    if macro:
+                        new_robots, new_boxes, beyond, moves = macro
+
+                if new_boxes is not boxes and SokobanState.deadlock_detection and \
+                        deadlock.is_deadlock(self.width, self.height, self.obstacles, self.storage, new_robots,
+                                             new_boxes, beyond):
+                    StateSpace.dead_ends = StateSpace.dead_ends + 1
+                    continue
 
-                new_state = SokobanState(str(robot) + " " + direction.name, self.gval + transition_cost, self,
-                                         self.width, self.height, new_robots, frozenset(new_boxes), self.storage,
-                                         self.obstacles)
+                if macro:
+                    new_state = SokobanState(names[robot][d] + ''.join(' ' + DIRECTIONS[m].name for m in moves),
+                                             self.gval + transition_cost * (1 + len(moves)), self,
+                                             self.width, self.height, new_robots, new_boxes, self.storage,
+                                             self.obstacles)
+                    new_state.macro = (robot, (d,) + tuple(moves))
+                else:
+                    new_state = SokobanState(names[robot][d], self.gval + transition_cost, self,
+                                             self.width, self.height, new_robots, new_boxes, self.storage,
+                                             self.obstacles)
+                if reduce:
+                    new_state.last_move = (robot, touched)
+                if SokobanState.operator_decomposition:
+                    new_state.od_index = next_index
+                    new_state.od_moved = next_index != 0
                 successors.append(new_state)
 
         return successors
 
+    def expanded(self):
+        '''
+        Returns self if no state on its path is a macro move, else an equal state whose path has
+        every macro replaced by the states of its moves.
+        '''
+        path = []
+        s = self
+        while s:
+            path.append(s)
+            s = s.parent
+        if all(s.macro is None for s in path):
+            return self
+        path.reverse()
+        names = action_names(len(self.robots))
+        state = path[0]
+        for s in path[1:]:
+            if s.macro is None:
+                state = SokobanState(s.action, state.gval + 1, state, s.width, s.height, s.robots, s.boxes,
+                                     s.storage, s.obstacles)
+                continue
+            robot, moves = s.macro
+            for d in moves:
+                target = DIRECTIONS[d].move(state.robots[robot])
+                boxes = state.boxes
+                if target in boxes:
+                    boxes = boxes.difference((target,)).union((DIRECTIONS[d].move(target),))
+                state = SokobanState(names[robot][d], state.gval + 1, state, s.width, s.height,
+                                     state.robots[:robot] + (target,) + state.robots[robot + 1:], boxes,
+                                     s.storage, s.obstacles)
+        return state
+
+    def print_path(self):
+        '''print the sequence of actions used to reach self, one move at a time'''
+        StateSpace.print_path(self.expanded())
+
     def hashable_state(self):
         '''Return a data item that can be used as a dictionary key to UNIQUELY represent a state.'''
+        if self.od_index:
+            return hash((self.robots, self.boxes, self.od_index, self.od_moved))
+        if SokobanState.robot_symmetry:
+            return hash((self.canonical_robots(), self.boxes))
         return hash((self.robots, self.boxes))
 
+    def is_intermediate(self):
+        '''True for the states of operator decomposition part way through a joint step.'''
+        return self.od_index != 0
+
+    def pack(self):
+        '''
+        Returns the robots and boxes as bytes: two bytes per robot (its square's y * width + x)
+        followed by the box bitmask. All states of a level have encodings of the same length.
+        '''
+        width = self.width
+        robots = self.canonical_robots() if SokobanState.robot_symmetry else self.robots
+        box_mask = 0
+        for x, y in self.boxes:
+            box_mask |= 1 << (y * width + x)
+        return struct.pack('>{}H'.format(len(robots)), *(y * width + x for x, y in robots)) + \
+            box_mask.to_bytes((width * self.height + 7) // 8, 'big')
+
+    def unpack(self, data, action, gval, parent):
+        '''Returns the state of this level that pack() encoded as data.'''
+        width = self.width
+        count = len(self.robots)
+        robots = tuple((square % width, square // width)
+                       for square in struct.unpack_from('>{}H'.format(count), data))
+        box_mask = int.from_bytes(data[2 * count:], 'big')
+        boxes = []
+        while box_mask:
+            square = (box_mask & -box_mask).bit_length() - 1
+            boxes.append((square % width, square // width))
+            box_mask &= box_mask - 1
+        return SokobanState(action, gval, parent, width, self.height, robots, frozenset(boxes), self.storage,
+                            self.obstacles)
+
+    def canonical_robots(self):
+        '''
+        Returns the robot locations in sorted order. Two states whose robots only differ
+        by a permutation have the same canonical robots.
+        '''
+        return tuple(sorted(self.robots))
+
     def state_string(self):
         '''Returns a string representation fo a state that can be printed to stdout.'''
         map = []
@@ -135,6 +279,69 @@ class SokobanState(StateSpace):
         print("ACTION was " + self.action)
         print(self.state_string())
 
+class MoveTable:
+    '''
+    The moves available from every square of a room, precomputed once per room so
+    that successor generation only needs table lookups and bitmask tests.
+    '''
+
+    def __init__(self, width, height, obstacles):
+        '''
+        Builds the tables of a width x height room with the given obstacles.
+        bits[location] is the bit of that square in occupancy bitmasks. moves[location]
+        holds a (direction index, target, target bit, beyond, beyond bit) tuple for every
+        direction a robot at location can step in, in (UP, RIGHT, DOWN, LEFT) order;
+        beyond is where a box on target would be pushed to, and its bit is 0 if that
+        is a wall.
+        '''
+        self.bits = dict()
+        for y in range(height):
+            for x in range(width):
+                if (x, y) not in obstacles:
+                    self.bits[(x, y)] = 1 << (y * width + x)
+        self.moves = dict()
+        for location in self.bits:
+            moves = []
+            for d, direction in enumerate(DIRECTIONS):
+                target = direction.move(location)
+                if target not in self.bits:
+                    continue
+                beyond = direction.move(target)
+                moves.append((d, target, self.bits[target], beyond, self.bits.get(beyond, 0)))
+            self.moves[location] = tuple(moves)
+
+
+# _action_names[robot][d] is the name of the action moving robot in DIRECTIONS[d].
+_action_names = []
+
+
+def action_names(robots):
+    '''Returns the action name table for (at least) the given number of robots.'''
+    while len(_action_names) < robots:
+        robot = len(_action_names)
+        _action_names.append(tuple(str(robot) + " " + direction.name for direction in DIRECTIONS))
+    return _action_names
+
+
+# Number of rooms whose MoveTable is kept in memory (oldest dropped first).
+MOVE_TABLE_LIMIT = 16
+
+# MoveTable objects, keyed by (width, height, obstacles).
+_move_tables = dict()
+
+
+def move_table(width, height, obstacles):
+    '''Returns the (cached) MoveTable of a room.'''
+    key = (width, height, obstacles)
+    table = _move_tables.get(key)
+    if table is None:
+        table = MoveTable(width, height, obstacles)
+        if len(_move_tables) >= MOVE_TABLE_LIMIT:
+            del _move_tables[next(iter(_move_tables))]
+        _move_tables[key] = table
+    return table
+
+
 def sokoban_goal_state(state):
     '''Returns True if we have reached a goal state'''
     '''INPUT: a sokoban state'''
@@ -327,6 +534,7 @@ UP = Direction("up", (0, -1))
 RIGHT = Direction("right", (1, 0))
 DOWN = Direction("down", (0, 1))
 LEFT = Direction("left", (-1, 0))
+DIRECTIONS = (UP, RIGHT, DOWN, LEFT)
 
 
 
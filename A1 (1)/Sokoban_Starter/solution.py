@@ -7,6 +7,7 @@
 
 import os  # for time functions
 import math  # for infinity
+import copy  # for re-linking improved plans
 from search import *  # for search engines
 from sokoban import sokoban_goal_state, SokobanState, Direction, \
     PROBLEMS  # for Sokoban specific classes and problems
@@ -159,6 +160,26 @@ def weighted_astar(initial_state, heur_fn, weight, timebound):
     return search.search(timebound)
 
 
+def focal_search(initial_state, heur_fn, weight=2, timebound=5, dist_fn=None):
+    '''Bounded suboptimal search: the solution found costs at most weight times the optimal cost,
+       provided heur_fn is admissible (e.g. heur_manhattan_distance).'''
+    '''INPUT: a sokoban state that represents the start state, an admissible heuristic, the bound and a timebound'''
+    '''OUTPUT: A goal state (if a goal is found), else False as well as a SearchStats object'''
+    search = SearchEngine(strategy='focal', cc_level='full')
+    search.init_search(initial_state, sokoban_goal_state, heur_fn, weight=weight, dist_fn=dist_fn)
+    return search.search(timebound)
+
+
+def explicit_estimation_search(initial_state, heur_fn, hhat_fn=heur_alternate, weight=2, timebound=5):
+    '''Explicit Estimation Search: like focal_search, but guided by an inadmissible heuristic hhat_fn
+       (by default heur_alternate) while heur_fn (admissible) keeps the solution within the bound.'''
+    '''INPUT: a sokoban state that represents the start state, the two heuristics, the bound and a timebound'''
+    '''OUTPUT: A goal state (if a goal is found), else False as well as a SearchStats object'''
+    search = SearchEngine(strategy='ees', cc_level='full')
+    search.init_search(initial_state, sokoban_goal_state, heur_fn, weight=weight, hhat_fn=hhat_fn)
+    return search.search(timebound)
+
+
 def iterative_astar(initial_state, heur_fn, weight=1,
                     timebound=5):
     '''Provides an implementation of realtime a-star, as described in the HW1 handout'''
@@ -170,6 +191,9 @@ def iterative_astar(initial_state, heur_fn, weight=1,
     remaining_time = timebound
     step = 0.5
     best_cost = float('inf')
+    # every iteration scores mostly the same states, share one memo across them.
+    if not isinstance(heur_fn, HeuristicCache):
+        heur_fn = HeuristicCache(heur_fn)
 
     while weight >= 1 and remaining_time > 0:
         se = SearchEngine(strategy='custom', cc_level='full')
@@ -193,16 +217,130 @@ def iterative_gbfs(initial_state, heur_fn, timebound=5):  # only use h(n)
     '''implementation of iterative gbfs algorithm'''
     best_solution = None
     best_stats = None
-    remaining_time = timebound
+    if not isinstance(heur_fn, HeuristicCache):
+        heur_fn = HeuristicCache(heur_fn)
 
-    while remaining_time > 0:
-        se = SearchEngine(strategy='best_first', cc_level='full')
-        se.init_search(initial_state, sokoban_goal_state, heur_fn)
-        solution, stats = se.search(remaining_time)
+    # one search, continued after each goal; iter_solutions prunes paths that cost more
+    # than the best solution found so far.
+    se = SearchEngine(strategy='best_first', cc_level='full')
+    se.init_search(initial_state, sokoban_goal_state, heur_fn)
+    for solution, stats in se.iter_solutions(timebound):
+        best_solution, best_stats = solution, stats
 
-        if solution:
-            best_solution, best_stats = solution, stats
+    return best_solution, best_stats
 
-        remaining_time -= stats.total_time if stats else 0
 
-    return best_solution, best_stats
+# PLAN IMPROVEMENT
+def _segment_heuristic(target):
+    '''Returns an admissible heuristic for reaching exactly the robots and boxes of target.'''
+
+    def heur_segment(state):
+        # every move moves one robot one square, and every push moves one box one square.
+        robots = sum(abs(r[0] - t[0]) + abs(r[1] - t[1]) for r, t in zip(state.robots, target.robots))
+        boxes = sum(min(abs(box[0] - goal[0]) + abs(box[1] - goal[1]) for goal in target.boxes - state.boxes)
+                    for box in state.boxes - target.boxes)
+        return max(robots, boxes)
+
+    return heur_segment
+
+
+def _shortcut(start, target, moves, timebound, last=False):
+    '''
+    Returns the states (after start) of a plan from start to target shorter than moves, or None if
+    A* finds none within timebound seconds. If last, target is the goal of the whole plan, and the
+    plan may end in any goal state instead.
+    '''
+    initial = copy.copy(start)
+    initial.parent = None
+    initial.gval = 0
+    se = SearchEngine('astar', 'full')
+    se.report_timeout = False
+    if last:
+        se.init_search(initial, sokoban_goal_state, heur_manhattan_distance)
+    else:
+        se.init_search(initial, lambda state: state.robots == target.robots and state.boxes == target.boxes,
+                       _segment_heuristic(target))
+    goal, _ = se.search(timebound, costbound=(moves - 1, math.inf, moves - 1))
+    if not goal:
+        return None
+    states = []
+    while goal.parent:
+        states.append(goal)
+        goal = goal.parent
+    states.reverse()
+    return states
+
+
+def improve_plan(goal, window=12, timebound=2):
+    '''Shortens the plan leading to goal by re-searching pieces of it optimally.'''
+    '''INPUT: a goal state (as returned by the search algorithms), the number of moves re-searched at once and a
+       timebound (number of seconds)'''
+    '''OUTPUT: a goal state whose plan is no longer than goal's, with its states as parents'''
+    '''A state met twice on the plan is a loop and is cut out. Then a window of window moves slides over the plan,
+       and A* looks for a shorter way between the states at its ends (or, for the last window, from its first state
+       to any goal state); it is repeated while that shortens the plan and there is time left.'''
+    stop = os.times()[0] + timebound
+    path = []
+    state = goal.expanded()
+    while state:
+        path.append(state)
+        state = state.parent
+    path.reverse()
+
+    # the window searches use plain moves, so that every shortcut is a sequence of single moves.
+    modes = (SokobanState.macro_moves, SokobanState.operator_decomposition, SokobanState.partial_order_reduction,
+             SokobanState.robot_symmetry)
+    SokobanState.macro_moves = SokobanState.operator_decomposition = False
+    SokobanState.partial_order_reduction = SokobanState.robot_symmetry = False
+    try:
+        improved = True
+        while improved and os.times()[0] < stop:
+            improved = False
+            seen = dict()
+            for i, state in enumerate(path):
+                key = (state.robots, state.boxes)
+                if key in seen:
+                    # keep the state's first visit; path[i + 1] moves on from the same place.
+                    path = path[:seen[key] + 1] + path[i + 1:]
+                    improved = True
+                    break
+                seen[key] = i
+            if improved:
+                continue
+
+            i = 0
+            while i < len(path) - 1:
+                # a timebound of 0 would mean no bound at all to the window search.
+                remaining = stop - os.times()[0]
+                if remaining <= 0:
+                    break
+                j = min(i + window, len(path) - 1)
+                # the last window may end in any goal state, unless the pass has shortened the plan already
+                # (searches to an exact state are cheaper, so they get the time first).
+                last = j == len(path) - 1 and not improved
+                states = _shortcut(path[i], path[j], j - i, remaining, last)
+                if states is None:
+                    i = i + max(1, window // 2)
+                elif last:
+                    path = path[:i + 1] + states
+                    improved = True
+                else:
+                    # states ends on path[j]'s robots and boxes, with the action that reaches them.
+                    path = path[:i + 1] + states + path[j + 1:]
+                    improved = True
+    finally:
+        SokobanState.macro_moves, SokobanState.operator_decomposition, SokobanState.partial_order_reduction, \
+            SokobanState.robot_symmetry = modes
+
+    state = None
+    for s in path:
+        s = copy.copy(s)
+        if state is None:
+            s.parent = None
+            s.gval = path[0].gval
+        else:
+            s.parent = state
+            s.gval = state.gval + 1
+        s.macro = None
+        state = s
+    return state if state.gval < goal.gval else goal
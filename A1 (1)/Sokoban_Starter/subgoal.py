@@ -0,0 +1,263 @@
+'''Subgoal decomposition.
+
+   A* over every box at once runs out of time on levels with many boxes.
+   SubgoalSearch breaks such a level into stages and solves them one after
+   the other with a SearchEngine:
+
+   A) A packing order of the storage points is worked out first. If the
+      storage points lie in a goal room (see macros.py) its packing order is
+      used. Otherwise the order is built greedily: the next storage point is
+      the most cornered one (the most walls and already filled storage points
+      beside it) whose filling leaves every storage point still to be filled
+      connected to the rest of the level, so storage points that would wall
+      others off are filled last.
+   B) Stage k asks for a box on each of the first k * boxes_per_stage storage
+      points of the order (boxes on earlier points may be moved meanwhile, as
+      long as they are back at the end). Its heuristic only counts those
+      storage points, so each stage is a small search. The last stage fills as
+      many storage points as there are boxes, which stores every box.
+   C) Each stage starts from the goal state of the one before, so the
+      states' parents chain the stages' plans into one plan for the level.
+   D) If a stage finds no solution (it has no plan, or it uses up its share of
+      the time), the rest of the level is searched jointly from where the
+      failed stage started, with heur_fn, in the time that is left.
+
+   The plan is not optimal, even with astar for the stages.
+
+   Usage:
+      python subgoal.py [--problem 9 | --level LEVELS.xsb --number 1]
+                        [--boxes-per-stage 1] [--weight 1] [--timebound 30]
+'''
+import argparse
+import os
+
+from search import *
+from sokoban import sokoban_goal_state
+from solution import heur_manhattan_distance
+import macros
+
+_DELTAS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+
+def packing_order(state):
+    '''Returns the storage points of state's level in the order SubgoalSearch fills them.'''
+    info = macros.level_macros(state.width, state.height, state.obstacles, state.storage)
+    if info.order is not None:
+        return info.order
+
+    floor = set((x, y) for y in range(state.height) for x in range(state.width)
+                if (x, y) not in state.obstacles)
+    remaining = set(state.storage)
+    filled = set()
+    order = []
+    while remaining:
+        best = None
+        for goal in sorted(remaining):
+            blocked = sum(1 for dx, dy in _DELTAS
+                          if (goal[0] + dx, goal[1] + dy) not in floor or (goal[0] + dx, goal[1] + dy) in filled)
+            keeps_connected = _connected(floor - filled - {goal}, remaining - {goal})
+            key = (keeps_connected, blocked)
+            if best is None or key > best[0]:
+                best = (key, goal)
+        goal = best[1]
+        remaining.remove(goal)
+        filled.add(goal)
+        order.append(goal)
+    return tuple(order)
+
+
+def _connected(squares, goals):
+    '''True if all of goals lie in the largest connected region of squares.'''
+    unseen = set(squares)
+    largest = set()
+    while unseen:
+        start = unseen.pop()
+        region = {start}
+        stack = [start]
+        while stack:
+            x, y = stack.pop()
+            for dx, dy in _DELTAS:
+                nxt = (x + dx, y + dy)
+                if nxt in unseen:
+                    unseen.remove(nxt)
+                    region.add(nxt)
+                    stack.append(nxt)
+        if len(region) > len(largest):
+            largest = region
+    return goals <= largest
+
+
+def stage_goal(targets):
+    '''Returns the goal function of a stage: a box on every one of targets.'''
+
+    def goal_fn(state):
+        return targets <= state.boxes
+
+    return goal_fn
+
+
+def stage_heuristic(targets):
+    '''
+    Returns the heuristic of a stage: for every target without a box, the Manhattan distance to the
+    nearest box not on a target, plus the distance from the robots to the box nearest a target (less
+    one, since the robot pushes from beside it). Without the robots' part, the many ways of walking
+    the robots up to a box would all look alike.
+    '''
+
+    def heur_stage(state):
+        free = [box for box in state.boxes if box not in targets]
+        total = 0
+        nearest = None
+        for goal in targets:
+            if goal not in state.boxes and free:
+                distance, box = min((abs(box[0] - goal[0]) + abs(box[1] - goal[1]), box) for box in free)
+                total += distance
+                if nearest is None or distance < nearest[0]:
+                    nearest = (distance, box)
+        if nearest is not None:
+            box = nearest[1]
+            total += min(abs(robot[0] - box[0]) + abs(robot[1] - box[1]) for robot in state.robots) - 1
+        return total
+
+    return heur_stage
+
+
+class StageStats:
+    '''What one stage of a SubgoalSearch did.'''
+
+    def __init__(self, stage, targets, solved, cost, expanded, seconds):
+        self.stage = stage
+        self.targets = targets
+        self.solved = solved
+        self.cost = cost
+        self.expanded = expanded
+        self.seconds = seconds
+
+    def __str__(self):
+        return '{:>5} {:>7} {:>6} {:>6} {:>10} {:>8.2f}'.format(
+            self.stage, self.targets, 'yes' if self.solved else 'no', '-' if self.cost is None else self.cost,
+            self.expanded, self.seconds)
+
+
+STAGE_HEADER = '{:>5} {:>7} {:>6} {:>6} {:>10} {:>8}'.format('stage', 'targets', 'solved', 'cost', 'expanded',
+                                                             'seconds')
+
+
+class SubgoalSearch:
+    '''Solves a Sokoban level one group of storage points at a time.'''
+
+    def __init__(self, heur_fn=heur_manhattan_distance, boxes_per_stage=1, weight=1):
+        '''
+        @param heur_fn: the heuristic of the joint search made when a stage fails.
+        @param boxes_per_stage: how many more storage points each stage fills.
+        @param weight: the weight of the stages' (and the joint) searches: 1 for A*, more for
+                       weighted A*.
+        '''
+        if boxes_per_stage < 1:
+            raise Exception("Each stage must fill at least one storage point")
+        self.heur_fn = heur_fn
+        self.boxes_per_stage = boxes_per_stage
+        self.weight = weight
+        self.trace = 0
+        self.stages = []
+
+    def trace_on(self, level=1):
+        '''Print every stage as it ends.'''
+        self.trace = level
+
+    def trace_off(self):
+        self.trace = 0
+
+    def search(self, initial_state, timebound=30):
+        '''
+        Searches for a plan of initial_state's level in at most timebound seconds. Returns (goal
+        state or False, SearchStats), the counts being the totals over all the searches made.
+        '''
+        start = os.times()[0]
+        self.stages = []
+        self.totals = [0] * 6
+        order = packing_order(initial_state)
+        count = min(len(order), len(initial_state.boxes))
+        # the last stage fills count storage points, so every box is stored.
+        groups = [frozenset(order[:min(k, count)]) for k in range(self.boxes_per_stage, count + self.boxes_per_stage,
+                                                                   self.boxes_per_stage)]
+
+        state = initial_state
+        for number, targets in enumerate(groups):
+            remaining = start + timebound - os.times()[0]
+            if remaining <= 0:
+                return False, self._stats(start)
+            # a stage may use up to twice its even share of the time left.
+            share = min(remaining, 2 * remaining / (len(groups) - number))
+            goal = self._stage(number, state, len(targets), stage_goal(targets), stage_heuristic(targets), share)
+            if not goal:
+                break
+            state = goal
+        else:
+            # with more boxes than storage points, the last stage is not a goal state.
+            return (state if sokoban_goal_state(state) else False), self._stats(start)
+
+        # a stage failed: search for the rest of the level jointly.
+        remaining = start + timebound - os.times()[0]
+        goal = False
+        if remaining > 0:
+            goal = self._stage('joint', state, count, sokoban_goal_state, self.heur_fn, remaining)
+        return goal, self._stats(start)
+
+    def _stage(self, number, state, targets, goal_fn, heur_fn, timebound):
+        '''Searches from state for goal_fn. Returns the goal state found or False.'''
+        se = SearchEngine('astar' if self.weight == 1 else 'custom', 'full')
+        se.report_timeout = False
+        weight = self.weight
+        se.init_search(state, goal_fn, heur_fn, lambda sN: sN.gval + weight * sN.hval)
+        goal, stats = se.search(timebound)
+        for i, value in enumerate((stats.states_expanded, stats.states_generated, stats.states_pruned_cycles,
+                                   stats.states_pruned_cost, stats.total_time, stats.states_pruned_deadlock)):
+            self.totals[i] = self.totals[i] + value
+        stage = StageStats(number, targets, bool(goal), goal.gval - state.gval if goal else None,
+                           stats.states_expanded, stats.total_time)
+        self.stages.append(stage)
+        if self.trace:
+            if len(self.stages) == 1:
+                print(STAGE_HEADER)
+            print(stage)
+        return goal
+
+    def _stats(self, start):
+        stats = SearchStats(*self.totals)
+        stats.total_time = os.times()[0] - start
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve a Sokoban level one storage point group at a time.')
+    parser.add_argument('--problem', type=int, default=9, help='index into sokoban.PROBLEMS')
+    parser.add_argument('--level', help='XSB level file (instead of --problem)')
+    parser.add_argument('--number', type=int, default=1, help='level number in --level')
+    parser.add_argument('--boxes-per-stage', type=int, default=1)
+    parser.add_argument('--weight', type=float, default=1, help='1 for A*, more for weighted A*')
+    parser.add_argument('--timebound', type=float, default=30, help='seconds')
+    args = parser.parse_args(argv)
+
+    from sokoban import PROBLEMS
+    if args.level:
+        import levels
+        state = next((state for number, _, state in levels.load_named_levels(args.level)
+                      if number == args.number), None)
+        if state is None:
+            parser.error('{} has no level {}'.format(args.level, args.number))
+    else:
+        state = PROBLEMS[args.problem]
+
+    search = SubgoalSearch(boxes_per_stage=args.boxes_per_stage, weight=args.weight)
+    search.trace_on()
+    goal, stats = search.search(state, args.timebound)
+    if goal:
+        print('Solution of length {} found.'.format(goal.gval))
+    else:
+        print('No solution found.')
+    print(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+'''Vectorized breadth first search.
+
+   VectorBFS searches a level exhaustively, like SearchEngine's breadth first
+   search, but expands a whole layer (the states at one depth) at once with
+   NumPy array operations instead of one successors() call per state. It
+   finds the optimal plan length (every move costs 1) and the plan itself,
+   and proves a level unsolvable when a layer comes out empty. It is meant
+   for small and medium levels, where every layer fits in memory, for
+   example to get the optimal costs that benchmarks compare against.
+
+   A) A state is a row of unsigned 64-bit integers: the bitmask of the boxes
+      over the level's squares (square (x, y) is bit y * width + x), in as
+      many words as it takes, followed by the square of every robot.
+   B) The successors of a layer are made one robot and one direction at a
+      time for all rows together: the target and beyond squares come from
+      per level lookup tables, and box and robot tests are bit and equality
+      tests on whole columns. Pushes onto dead squares (from which a lone box
+      can reach no storage point, see deadlock.py) are dropped.
+   C) Duplicates are removed with np.unique on the rows, and so is every row
+      already seen in an earlier layer, found with np.searchsorted in the
+      sorted array of all the rows seen so far. The new rows are merged into
+      that array where np.searchsorted placed them.
+   D) For every row the index of its parent row in the layer before is kept,
+      so once a layer holds a goal the plan is rebuilt by following parents
+      back, and turned into a chain of SokobanStates like the other solvers
+      return.
+
+   Layers grow quickly, so before a layer is expanded the size of its
+   successors is estimated, and the search stops (returning the stats so
+   far) if that would go over memory_limit bytes. The time bound is checked
+   between the batches of successors, not only between layers.
+
+   NumPy is only needed to run the search; importing this module without it
+   works, and VectorBFS says what is missing.
+
+   Usage:
+      python vector_bfs.py [--problem 3 | --level LEVELS.xsb --number 1] [--timebound 60]
+                           [--memory-limit 1024]
+'''
+import argparse
+import os
+import time
+
+from search import SearchStats
+from sokoban import SokobanState, DIRECTIONS, action_names
+import deadlock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bytes the successors of a layer may take before the search stops, when memory_limit is not given.
+MEMORY_LIMIT = 1 << 30
+
+
+def _keys(rows):
+    '''Returns the rows of a 2-D array as a 1-D array of opaque values, for sorting and comparing whole rows.'''
+    rows = np.ascontiguousarray(rows)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+
+def _same(a, b):
+    '''Returns, for every i, whether a[i] and b[i] (values made by _keys) hold the same row.'''
+    a = a.view(np.uint64).reshape(len(a), -1)
+    b = b.view(np.uint64).reshape(len(b), -1)
+    return np.all(a == b, axis=1)
+
+
+class VectorBFS:
+    '''Breadth first search over NumPy arrays of packed states, a layer at a time.'''
+
+    def __init__(self, initial_state, memory_limit=MEMORY_LIMIT):
+        '''
+        @param initial_state: the SokobanState to start from. The goal is every box on a storage point.
+        @param memory_limit: the most bytes the successors of one layer may take (see _successor_bytes).
+        '''
+        if np is None:
+            raise Exception("VectorBFS needs NumPy, which is not installed (pip install numpy)")
+        self.initial_state = initial_state
+        self.width = initial_state.width
+        self.cells = initial_state.width * initial_state.height
+        self.words = (self.cells + 63) // 64
+        self.robots = len(initial_state.robots)
+        self.memory_limit = memory_limit
+        self.trace = 0
+        self.layers = []
+        self._tables()
+
+    def trace_on(self, level=1):
+        '''Print the size of every layer as it is built.'''
+        self.trace = level
+
+    def trace_off(self):
+        self.trace = 0
+
+    def _tables(self):
+        '''
+        Builds the per level lookup tables. Squares are indexed y * width + x; index cells stands for
+        a wall (or anywhere off the room), so every table has cells + 1 entries.
+        '''
+        state = self.initial_state
+        width = self.width
+        cells = self.cells
+        wall = cells
+
+        def index(square):
+            x, y = square
+            if x < 0 or x >= width or y < 0 or y >= state.height or square in state.obstacles:
+                return wall
+            return y * width + x
+
+        self.target = []
+        self.beyond = []
+        for direction in DIRECTIONS:
+            target = np.full(cells + 1, wall, dtype=np.int64)
+            beyond = np.full(cells + 1, wall, dtype=np.int64)
+            for i in range(cells):
+                square = (i % width, i // width)
+                if index(square) == wall:
+                    continue
+                target[i] = index(direction.move(square))
+                if target[i] != wall:
+                    beyond[i] = index(direction.move(direction.move(square)))
+            self.target.append(target)
+            self.beyond.append(beyond)
+
+        info = deadlock.level_info(state.width, state.height, state.obstacles, state.storage)
+        self.live = np.zeros(cells + 1, dtype=bool)
+        for x, y in info.live:
+            self.live[y * width + x] = True
+
+        self.storage = np.zeros(self.words, dtype=np.uint64)
+        for x, y in state.storage:
+            i = y * width + x
+            self.storage[i >> 6] |= np.uint64(1) << np.uint64(i & 63)
+
+    def encode(self, state):
+        '''Returns the row of state.'''
+        row = np.zeros(self.words + self.robots, dtype=np.uint64)
+        for x, y in state.boxes:
+            i = y * self.width + x
+            row[i >> 6] |= np.uint64(1) << np.uint64(i & 63)
+        for r, (x, y) in enumerate(state.robots):
+            row[self.words + r] = y * self.width + x
+        return row
+
+    def _has_box(self, layer, squares):
+        '''For every row of layer, whether there is a box on the row's entry of squares (False for walls).'''
+        inside = squares < self.cells
+        safe = np.where(inside, squares, 0)
+        words = layer[np.arange(len(layer)), safe >> 6]
+        bits = (words >> (safe & 63).astype(np.uint64)) & np.uint64(1)
+        return inside & (bits == 1)
+
+    def _has_robot(self, layer, squares, robot):
+        '''For every row of layer, whether a robot other than robot stands on the row's entry of squares.'''
+        found = np.zeros(len(layer), dtype=bool)
+        for other in range(self.robots):
+            if other != robot:
+                found |= layer[:, self.words + other].astype(np.int64) == squares
+        return found
+
+    def _successor_bytes(self, layer):
+        '''Returns an upper bound on the bytes taken by the successors of layer (rows and parent indices).'''
+        return len(layer) * self.robots * len(DIRECTIONS) * ((self.words + self.robots) * 8 + 8)
+
+    def _expand(self, layer, stop=None):
+        '''
+        Returns (successor rows, index of each one's parent in layer, pushes onto dead squares dropped),
+        or None if os.times()[0] passes stop before all the successors are made.
+        '''
+        words = self.words
+        children = []
+        parents = []
+        dead = 0
+        for robot in range(self.robots):
+            location = layer[:, words + robot].astype(np.int64)
+            for d in range(len(DIRECTIONS)):
+                if stop and os.times()[0] > stop:
+                    return None
+                target = self.target[d][location]
+                ok = (target < self.cells) & ~self._has_robot(layer, target, robot)
+                box = self._has_box(layer, target)
+
+                walk = np.nonzero(ok & ~box)[0]
+                rows = layer[walk]
+                rows[:, words + robot] = target[walk].astype(np.uint64)
+                children.append(rows)
+                parents.append(walk)
+
+                beyond = self.beyond[d][location]
+                push = ok & box & (beyond < self.cells) & ~self._has_box(layer, beyond) & \
+                    ~self._has_robot(layer, beyond, robot)
+                alive = push & self.live[beyond]
+                dead = dead + int(np.count_nonzero(push & ~alive))
+                push = np.nonzero(alive)[0]
+                rows = layer[push]
+                t = target[push]
+                b = beyond[push]
+                index = np.arange(len(push))
+                rows[index, t >> 6] &= ~(np.uint64(1) << (t & 63).astype(np.uint64))
+                rows[index, b >> 6] |= np.uint64(1) << (b & 63).astype(np.uint64)
+                rows[:, words + robot] = t.astype(np.uint64)
+                children.append(rows)
+                parents.append(push)
+        return np.concatenate(children), np.concatenate(parents), dead
+
+    def _goals(self, layer):
+        '''Returns the indices of the rows of layer with every box on a storage point.'''
+        outside = layer[:, :self.words] & ~self.storage
+        return np.nonzero(np.all(outside == 0, axis=1))[0]
+
+    def search(self, timebound=None):
+        '''
+        Searches until a goal is found, a layer comes out empty (no goal is reachable), timebound
+        seconds have passed or the next layer would not fit in memory_limit. Returns (goal state or
+        False, SearchStats). The goal's gval is the optimal plan length, and its parents are the states
+        of the plan.
+        '''
+        start = os.times()[0]
+        stop = start + timebound if timebound else None
+        self.exhausted = False
+        self.layers = []
+        expanded = generated = duplicates = dead_ends = 0
+
+        layer = self.encode(self.initial_state)[np.newaxis, :]
+        parents = np.array([-1], dtype=np.int64)
+        seen = _keys(layer)
+        goal = False
+        while True:
+            began = time.perf_counter()
+            self.layers.append((layer, parents))
+            goals = self._goals(layer)
+            if len(goals):
+                goal = self._plan(int(goals[0]))
+                break
+            if self.memory_limit is not None and self._successor_bytes(layer) > self.memory_limit:
+                print("TRACE: Search would exceed the memory limit provided.")
+                break
+            expansion = self._expand(layer, stop)
+            if expansion is None:
+                print("TRACE: Search has exceeeded the time bound provided.")
+                break
+
+            children, parents, dead = expansion
+            expanded = expanded + len(layer)
+            generated = generated + len(children)
+            dead_ends = dead_ends + dead
+
+            keys = _keys(children)
+            keys, first = np.unique(keys, return_index=True)
+            at = np.searchsorted(seen, keys)
+            old = at < len(seen)
+            old[old] = _same(seen[at[old]], keys[old])
+            first = first[~old]
+            duplicates = duplicates + len(children) - len(first)
+            layer = children[first]
+            parents = parents[first]
+            # keys is sorted, so the new ones go in at the places searchsorted found for them.
+            seen = np.insert(seen, at[~old], keys[~old])
+
+            if self.trace:
+                if len(self.layers) == 1:
+                    print('{:>5} {:>12} {:>12} {:>8}'.format('depth', 'states', 'generated', 'seconds'))
+                print('{:>5} {:>12} {:>12} {:>8.3f}'.format(len(self.layers), len(layer), len(children),
+                                                            time.perf_counter() - began))
+            if len(layer) == 0:
+                self.exhausted = True
+                break
+
+        stats = SearchStats(expanded, generated, duplicates, 0, os.times()[0] - start, dead_ends)
+        return goal, stats
+
+    def _plan(self, index):
+        '''Returns the goal state of row index of the last layer, with the plan's states as its parents.'''
+        rows = []
+        for layer, parents in reversed(self.layers):
+            rows.append(layer[index])
+            index = int(parents[index])
+        rows.reverse()
+
+        names = action_names(self.robots)
+        state = self.initial_state
+        for row in rows[1:]:
+            robots = tuple((int(i) % self.width, int(i) // self.width) for i in row[self.words:])
+            robot = next(r for r in range(self.robots) if robots[r] != state.robots[r])
+            d = next(d for d, direction in enumerate(DIRECTIONS) if direction.move(state.robots[robot]) == robots[robot])
+            boxes = state.boxes
+            if robots[robot] in boxes:
+                boxes = boxes.difference((robots[robot],)).union((DIRECTIONS[d].move(robots[robot]),))
+            state = SokobanState(names[robot][d], state.gval + 1, state, state.width, state.height, robots, boxes,
+                                 state.storage, state.obstacles)
+        return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Exhaustive breadth first search of a Sokoban level, with NumPy.')
+    parser.add_argument('--problem', type=int, default=3, help='index into sokoban.PROBLEMS')
+    parser.add_argument('--level', help='XSB level file (instead of --problem)')
+    parser.add_argument('--number', type=int, default=1, help='level number in --level')
+    parser.add_argument('--timebound', type=float, default=60, help='seconds')
+    parser.add_argument('--memory-limit', type=float, default=MEMORY_LIMIT / (1 << 20),
+                        help='MiB the successors of one layer may take')
+    args = parser.parse_args(argv)
+
+    from sokoban import PROBLEMS
+    if args.level:
+        import levels
+        state = next((state for number, _, state in levels.load_named_levels(args.level)
+                      if number == args.number), None)
+        if state is None:
+            parser.error('{} has no level {}'.format(args.level, args.number))
+    else:
+        state = PROBLEMS[args.problem]
+
+    search = VectorBFS(state, int(args.memory_limit * (1 << 20)))
+    search.trace_on()
+    goal, stats = search.search(args.timebound)
+    if goal:
+        print('Optimal solution of length {} found.'.format(goal.gval))
+    elif search.exhausted:
+        print('No solution: every reachable state was searched.')
+    print(stats)
+
+
+if __name__ == '__main__':
+    main()